@@ -0,0 +1,191 @@
+import os
+import threading
+import time
+
+# Low-level boto3 clients, created on first use and shared by every warm
+# invocation of the container. boto3 itself is only imported then, so a
+# module that never reaches AWS (or only rarely, like SNS alerts) does not pay
+# for it at startup.
+AWS_MAX_POOL_CONNECTIONS = int(os.environ.get('AWS_MAX_POOL_CONNECTIONS', '10'))
+AWS_MAX_ATTEMPTS = int(os.environ.get('AWS_MAX_ATTEMPTS', '5'))
+AWS_CONNECT_TIMEOUT = float(os.environ.get('AWS_CONNECT_TIMEOUT', '2'))
+AWS_READ_TIMEOUT = float(os.environ.get('AWS_READ_TIMEOUT', '10'))
+# Sends of a batch request while DynamoDB keeps leaving part of it unprocessed
+BATCH_MAX_ATTEMPTS = int(os.environ.get('BATCH_MAX_ATTEMPTS', '8'))
+
+clients = {}
+clients_lock = threading.Lock()
+
+
+class UnprocessedRequests(Exception):
+    pass
+
+
+def batch_backoff(attempt):
+    time.sleep(min(0.05 * 2 ** attempt, 1))
+
+
+def batch_get_all(table, keys, ConsistentRead=False):
+    # BatchGetItem of at most 100 keys, resending the unprocessed ones with
+    # backoff. Raises UnprocessedRequests after BATCH_MAX_ATTEMPTS sends.
+    items = []
+    for attempt in range(BATCH_MAX_ATTEMPTS):
+        if attempt:
+            batch_backoff(attempt)
+        found, keys = table.batch_get(keys, ConsistentRead=ConsistentRead)
+        items.extend(found)
+        if not keys:
+            return items
+    raise UnprocessedRequests(f"{len(keys)} keys of {table.name} unprocessed after {BATCH_MAX_ATTEMPTS} attempts")
+
+
+def client_config():
+    from botocore.config import Config
+
+    return Config(
+        tcp_keepalive=True,
+        max_pool_connections=AWS_MAX_POOL_CONNECTIONS,
+        connect_timeout=AWS_CONNECT_TIMEOUT,
+        read_timeout=AWS_READ_TIMEOUT,
+        retries={'mode': 'adaptive', 'max_attempts': AWS_MAX_ATTEMPTS}
+    )
+
+
+def get_client(service, setup=None):
+    # setup(client) runs once, when the client is created
+    client = clients.get(service)
+    if client is None:
+        with clients_lock:
+            client = clients.get(service)
+            if client is None:
+                import boto3
+
+                client = boto3.client(service, config=client_config())
+                if setup:
+                    setup(client)
+                clients[service] = client
+    return client
+
+
+class DynamoDBTable:
+    # The boto3 Table calls this project makes, on the low-level client:
+    # plain Python values in and out (numbers as Decimal, binary as bytes or
+    # Binary). `client` is a function returning the shared DynamoDB client,
+    # so building a table costs nothing until its first request.
+    def __init__(self, name, client=lambda: get_client('dynamodb')):
+        self.name = self.table_name = name
+        self.client_factory = client
+        self._serializer = self._deserializer = None
+
+    @property
+    def client(self):
+        return self.client_factory()
+
+    def serialize(self, values):
+        if self._serializer is None:
+            from boto3.dynamodb.types import TypeSerializer
+            self._serializer = TypeSerializer()
+        return {name: self._serializer.serialize(value) for name, value in values.items()}
+
+    def deserialize(self, values):
+        if self._deserializer is None:
+            from boto3.dynamodb.types import TypeDeserializer
+            self._deserializer = TypeDeserializer()
+        return {name: self._deserializer.deserialize(value) for name, value in values.items()}
+
+    def _request(self, kwargs):
+        # Serializes the value-carrying parameters of a request
+        request = {'TableName': self.name}
+        for name, value in kwargs.items():
+            if value is None:
+                continue
+            if name in ('Key', 'Item', 'ExpressionAttributeValues', 'ExclusiveStartKey'):
+                value = self.serialize(value)
+            request[name] = value
+        return request
+
+    def get_item(self, Key, ConsistentRead=False):
+        response = self.client.get_item(**self._request({'Key': Key, 'ConsistentRead': ConsistentRead}))
+        if 'Item' in response:
+            response['Item'] = self.deserialize(response['Item'])
+        return response
+
+    def put_item(self, Item, **kwargs):
+        return self.client.put_item(**self._request({'Item': Item, **kwargs}))
+
+    def update_item(self, Key, UpdateExpression, **kwargs):
+        response = self.client.update_item(**self._request({'Key': Key, 'UpdateExpression': UpdateExpression,
+                                                            **kwargs}))
+        if 'Attributes' in response:
+            response['Attributes'] = self.deserialize(response['Attributes'])
+        return response
+
+    def query(self, **kwargs):
+        return self._page(self.client.query(**self._request(kwargs)))
+
+    def scan(self, **kwargs):
+        return self._page(self.client.scan(**self._request(kwargs)))
+
+    def _page(self, response):
+        response['Items'] = [self.deserialize(item) for item in response.get('Items', [])]
+        if 'LastEvaluatedKey' in response:
+            response['LastEvaluatedKey'] = self.deserialize(response['LastEvaluatedKey'])
+        return response
+
+    def batch_get(self, keys, ConsistentRead=False):
+        # One BatchGetItem (at most 100 keys). Returns the found items and the
+        # keys DynamoDB left unprocessed.
+        response = self.client.batch_get_item(RequestItems={self.name: {
+            'Keys': [self.serialize(key) for key in keys],
+            'ConsistentRead': ConsistentRead
+        }})
+        items = [self.deserialize(item) for item in response.get('Responses', {}).get(self.name, [])]
+        unprocessed = response.get('UnprocessedKeys', {}).get(self.name, {}).get('Keys', [])
+        return items, [self.deserialize(key) for key in unprocessed]
+
+    def batch_writer(self, overwrite_by_pkeys=None):
+        return BatchWriter(self, overwrite_by_pkeys)
+
+
+class BatchWriter:
+    # Buffers puts into BatchWriteItem calls of 25 items and resends whatever
+    # DynamoDB leaves unprocessed. With overwrite_by_pkeys a later put of the
+    # same key replaces the buffered one, as boto3's batch_writer does.
+    BATCH_SIZE = 25
+
+    def __init__(self, table, overwrite_by_pkeys=None):
+        self.table = table
+        self.key_names = overwrite_by_pkeys
+        self.pending = []
+
+    def put_item(self, Item):
+        if self.key_names:
+            key = [Item[name] for name in self.key_names]
+            self.pending = [item for item in self.pending if [item[name] for name in self.key_names] != key]
+        self.pending.append(Item)
+        if len(self.pending) >= self.BATCH_SIZE:
+            self._send(self.pending[:self.BATCH_SIZE])
+            self.pending = self.pending[self.BATCH_SIZE:]
+
+    def _send(self, items):
+        requests = [{'PutRequest': {'Item': self.table.serialize(item)}} for item in items]
+        for attempt in range(BATCH_MAX_ATTEMPTS):
+            if attempt:
+                batch_backoff(attempt)
+            response = self.table.client.batch_write_item(RequestItems={self.table.name: requests})
+            requests = response.get('UnprocessedItems', {}).get(self.table.name, [])
+            if not requests:
+                return
+        raise UnprocessedRequests(f"{len(requests)} items of {self.table.name} unprocessed "
+                                  f"after {BATCH_MAX_ATTEMPTS} attempts")
+
+    def flush(self):
+        while self.pending:
+            self._send(self.pending[:self.BATCH_SIZE])
+            self.pending = self.pending[self.BATCH_SIZE:]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
@@ -0,0 +1,173 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from indicator_engine import EMA_SHORT, EMA_LONG, SMA_SHORT, SMA_LONG
+
+# Offline, vectorized replay of the stream processor's strategy. The MAs,
+# crossovers and golden-buy/dead-sell bookkeeping follow calculate_ema,
+# calculate_sma, detect_signal and apply_cross_signal, so parameter grids can
+# be evaluated over long price series without going through Lambda.
+#
+# Inputs are the de-duplicated tick prices as stored in price_history, oldest
+# first.
+
+GOLDEN = 1
+DEAD = -1
+
+TRADE_DTYPE = np.dtype([
+    ('entry_index', np.int64),
+    ('exit_index', np.int64),
+    ('entry_price', np.float64),
+    ('exit_price', np.float64),
+    ('profit', np.float64),
+    ('profit_pct', np.float64),
+])
+
+
+def _prefix_mean(prices, count):
+    # Mean of prices[:t + 1] for the first `count` ticks (the warm-up rule
+    # shared by calculate_ema and calculate_sma)
+    return np.cumsum(prices[:count]) / np.arange(1, count + 1)
+
+
+def windowed_ema(prices, period):
+    # calculate_ema(prices[-period:], period) at every tick: an EMA seeded from
+    # the oldest price of the last `period` prices, which is a fixed weighted
+    # sum over the window
+    prices = np.asarray(prices, dtype=np.float64)
+    out = np.empty_like(prices)
+    warmup = min(period - 1, len(prices))
+    out[:warmup] = _prefix_mean(prices, warmup)
+    if len(prices) >= period:
+        multiplier = 2.0 / (period + 1)
+        decay = 1.0 - multiplier
+        weights = multiplier * decay ** np.arange(period - 1, -1, -1)
+        weights[0] = decay ** (period - 1)
+        out[period - 1:] = sliding_window_view(prices, period) @ weights
+    return out
+
+
+def rolling_sma(prices, period):
+    # calculate_sma(prices, period) at every tick
+    prices = np.asarray(prices, dtype=np.float64)
+    out = np.empty_like(prices)
+    warmup = min(period - 1, len(prices))
+    out[:warmup] = _prefix_mean(prices, warmup)
+    if len(prices) >= period:
+        out[period - 1:] = sliding_window_view(prices, period).sum(axis=1) / period
+    return out
+
+
+def detect_crosses(short_ma, long_ma):
+    # detect_signal at every tick. As in the stream processor, the previous
+    # values are the ones stored on the item (rounded to 5 decimals) and the
+    # first tick has nothing to compare against.
+    prev_short = np.round(np.concatenate(([short_ma[0]], short_ma[:-1])), 5)
+    prev_long = np.round(np.concatenate(([long_ma[0]], long_ma[:-1])), 5)
+    prev_short[0], prev_long[0] = short_ma[0], long_ma[0]
+
+    signals = np.zeros(len(short_ma), dtype=np.int8)
+    signals[(prev_short < prev_long) & (short_ma > long_ma)] = GOLDEN
+    signals[(prev_short > prev_long) & (short_ma < long_ma)] = DEAD
+    return signals
+
+
+def simulate_trades(prices, signals):
+    # Golden cross buys when flat, dead cross sells when holding. Only the
+    # (sparse) signal ticks are visited.
+    prices = np.asarray(prices, dtype=np.float64)
+    trades = []
+    holding = False
+    entry_index = -1
+    for index in np.flatnonzero(signals):
+        if signals[index] == GOLDEN and not holding:
+            holding, entry_index = True, index
+        elif signals[index] == DEAD and holding and prices[entry_index]:
+            entry, exit_ = prices[entry_index], prices[index]
+            trades.append((entry_index, index, entry, exit_, exit_ - entry, (exit_ - entry) / entry * 100))
+            holding = False
+    return np.array(trades, dtype=TRADE_DTYPE), (int(entry_index) if holding else None)
+
+
+def summarize(trades, open_entry=None):
+    if len(trades) == 0:
+        return {'trades': 0, 'total_profit_pct': 0.0, 'compounded_return_pct': 0.0,
+                'win_rate': 0.0, 'open_position': open_entry is not None}
+    return {
+        'trades': int(len(trades)),
+        'total_profit_pct': float(trades['profit_pct'].sum()),
+        'compounded_return_pct': float((np.prod(1 + trades['profit_pct'] / 100) - 1) * 100),
+        'win_rate': float((trades['profit'] > 0).mean()),
+        'open_position': open_entry is not None
+    }
+
+
+def backtest(prices, ema_short=EMA_SHORT, ema_long=EMA_LONG, sma_short=SMA_SHORT, sma_long=SMA_LONG):
+    prices = np.asarray(prices, dtype=np.float64)
+    results = {}
+    for kind, short_ma, long_ma in (
+        ('ema', windowed_ema(prices, ema_short), windowed_ema(prices, ema_long)),
+        ('sma', rolling_sma(prices, sma_short), rolling_sma(prices, sma_long)),
+    ):
+        signals = detect_crosses(short_ma, long_ma)
+        trades, open_entry = simulate_trades(prices, signals)
+        results[kind] = {
+            'signals': signals,
+            'trades': trades,
+            'summary': summarize(trades, open_entry)
+        }
+    return results
+
+
+def grid_search(prices_by_coin, short_periods, long_periods, kind='ema'):
+    # Evaluates every short < long pair for every coin. Each distinct period
+    # is computed once per coin and shared across the grid.
+    average = windowed_ema if kind == 'ema' else rolling_sma
+    rows = []
+    for coin_id, prices in prices_by_coin.items():
+        prices = np.asarray(prices, dtype=np.float64)
+        cache = {period: average(prices, period) for period in set(short_periods) | set(long_periods)}
+        for short in short_periods:
+            for long_ in long_periods:
+                if short >= long_:
+                    continue
+                trades, open_entry = simulate_trades(prices, detect_crosses(cache[short], cache[long_]))
+                rows.append({'coin_id': coin_id, 'kind': kind, 'short': short, 'long': long_,
+                             **summarize(trades, open_entry)})
+    return rows
+
+
+def load_prices(table, coin_id):
+    # Stored price history of one coin (either storage format) as arrays
+    from coin_state import CoinState
+
+    state = CoinState.load(table, coin_id)
+    history = state.price_history()
+    prices = np.array([float(entry['price']) for entry in history], dtype=np.float64)
+    timestamps = np.array([entry['timestamp'] for entry in history], dtype=object)
+    return prices, timestamps
+
+
+def compare_with_streaming(prices):
+    # Replays the same prices through the streaming IndicatorEngine in Decimal
+    # and returns the ticks where the two paths disagree on a signal
+    from decimal import Decimal
+    from indicator_engine import IndicatorEngine, detect_signal
+
+    engine = IndicatorEngine()
+    streaming = {'ema': np.zeros(len(prices), dtype=np.int8), 'sma': np.zeros(len(prices), dtype=np.int8)}
+    previous = None
+    for index, price in enumerate(prices):
+        update = engine.update(Decimal(repr(float(price))), str(index))
+        values = tuple(update[name] for name in ('ema_short', 'ema_long', 'sma_short', 'sma_long'))
+        current = values if previous is None else previous
+        for kind, (short, long_), (prev_short, prev_long) in (
+            ('ema', values[:2], current[:2]),
+            ('sma', values[2:], current[2:]),
+        ):
+            signal = detect_signal(short, long_, prev_short, prev_long)
+            streaming[kind][index] = GOLDEN if signal == 'Golden Cross' else DEAD if signal == 'Dead Cross' else 0
+        previous = tuple(round(value, 5) for value in values)
+
+    vectorized = backtest(prices)
+    return {kind: np.flatnonzero(streaming[kind] != vectorized[kind]['signals']) for kind in streaming}
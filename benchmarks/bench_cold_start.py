@@ -0,0 +1,159 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Measures what a Lambda cold start pays for each function, in a fresh Python
+# process per run: importing the module, creating the AWS clients it uses and
+# the first lambda_handler call (against stand-ins, so no network or AWS
+# account is needed). `boto3.resource` is the eager DynamoDB resource the
+# processor used to build at import time, for comparison.
+#
+#   python benchmarks/bench_cold_start.py --repeats 10
+#   python benchmarks/bench_cold_start.py --modules process_cryptostream --output cold.json
+
+MODULES = {
+    'process_cryptostream': ('process_cryptostream_lambda_function', ['dynamodb', 'sns']),
+    'fetch_prices': ('fetch_prices_lambda_function', ['kinesis']),
+    'sns_to_discord_forwarder': ('sns_to_discord_forwarder_lambda_function', []),
+    'boto3.resource': (None, []),
+}
+
+# Dummy settings so boto3 can build clients without credentials or network
+ENVIRONMENT = {
+    'AWS_DEFAULT_REGION': 'ap-southeast-1',
+    'AWS_ACCESS_KEY_ID': 'testing',
+    'AWS_SECRET_ACCESS_KEY': 'testing',
+    'DYNAMODB_TABLE': 'CryptoTrends_table',
+    'SNS_TOPIC_ARN': 'arn:aws:sns:ap-southeast-1:000000000000:CryptoTrendAlerts',
+    'DISCORD_WEBHOOK_URL': 'http://localhost/webhook',
+    'METRICS_SAMPLE_RATE': '0',
+}
+
+
+class FakeResponse:
+    def __init__(self, status, data=b'', headers=None):
+        self.status = status
+        self.data = data
+        self.headers = headers or {}
+
+
+class FakeHTTP:
+    def __init__(self, data=b'', status=200):
+        self.response = FakeResponse(status, data)
+
+    def request(self, method, url, **kwargs):
+        return self.response
+
+
+def first_invocation(name, module):
+    # One typical invocation, with every remote endpoint replaced
+    if name == 'process_cryptostream':
+        from stand_ins import CountingSNS, InMemoryDynamoDB
+        from bench_process_cryptostream import kinesis_batches, synthetic_ticks
+
+        dynamodb = InMemoryDynamoDB()
+        module.table = dynamodb.create_table(module.TABLE_NAME)
+        sns = CountingSNS()
+        module.sns_client = lambda: sns
+        event = {'Records': kinesis_batches(synthetic_ticks(10, 1), 10)[0]}
+    elif name == 'fetch_prices':
+        from stand_ins import CountingKinesis
+
+        coins = [{'id': coin, 'symbol': coin[:3], 'current_price': 1.5, 'market_cap': 1000, 'total_volume': 10,
+                  'last_updated': '2024-05-01T00:00:00.000Z'} for coin in sorted(module.DEFAULT_TARGET_COINS)]
+        module.http = FakeHTTP(json.dumps(coins).encode('utf-8'))
+        kinesis = CountingKinesis()
+        module.kinesis_client = lambda: kinesis
+        event = {}
+    else:
+        module.http = FakeHTTP(status=204)
+        message = {'coin': 'bitcoin', 'price': '1.5', 'signal': 'EMA: Golden Cross, SMA: None',
+                   'trend_status': 'EMA: Buy, SMA: Hold', 'timestamp': '2024-05-01T00:00:00.000Z'}
+        event = {'Records': [{'Sns': {'Message': json.dumps(message)}}]}
+
+    started = time.perf_counter()
+    module.lambda_handler(event, None)
+    return (time.perf_counter() - started) * 1000
+
+
+def measure(name):
+    # Runs in the child process; returns milliseconds per phase
+    module_name, services = MODULES[name]
+    result = {}
+    if module_name is None:
+        started = time.perf_counter()
+        import boto3
+        boto3.resource('dynamodb').Table(ENVIRONMENT['DYNAMODB_TABLE'])
+        result['import_ms'] = (time.perf_counter() - started) * 1000
+        return result
+
+    started = time.perf_counter()
+    module = __import__(module_name)
+    result['import_ms'] = (time.perf_counter() - started) * 1000
+
+    import io
+    from contextlib import redirect_stdout
+    with redirect_stdout(io.StringIO()):
+        result['first_invocation_ms'] = first_invocation(name, module)
+
+    if services:
+        from aws_clients import get_client
+
+        started = time.perf_counter()
+        for service in services:
+            get_client(service)
+        result['clients_ms'] = (time.perf_counter() - started) * 1000
+    return result
+
+
+def run_child(name):
+    environment = dict(os.environ)
+    for key, value in ENVIRONMENT.items():
+        environment.setdefault(key, value)
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--child', name],
+        cwd=ROOT, env=environment, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start benchmark for the Lambda modules")
+    parser.add_argument('--modules', nargs='+', choices=list(MODULES), default=list(MODULES))
+    parser.add_argument('--repeats', type=int, default=5, help="fresh processes per module")
+    parser.add_argument('--output', help="write results as JSON")
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        sys.path.insert(0, ROOT)
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        print(json.dumps(measure(args.child)))
+        return
+
+    results = []
+    for name in args.modules:
+        runs = [run_child(name) for _ in range(args.repeats)]
+        result = {'module': name}
+        for phase in ('import_ms', 'clients_ms', 'first_invocation_ms'):
+            values = [run[phase] for run in runs if phase in run]
+            if values:
+                result[phase] = round(statistics.median(values), 2)
+        results.append(result)
+        print(f"{name:<26} import {result['import_ms']:>8.2f} ms  "
+              f"clients {result.get('clients_ms', 0):>8.2f} ms  "
+              f"first invocation {result.get('first_invocation_ms', 0):>8.2f} ms")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+import argparse
+import base64
+import contextlib
+import io
+import json
+import math
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('DYNAMODB_TABLE', 'CryptoTrends_table')
+os.environ.setdefault('SNS_TOPIC_ARN', 'arn:aws:sns:ap-southeast-1:000000000000:CryptoTrendAlerts')
+os.environ.setdefault('AWS_DEFAULT_REGION', 'ap-southeast-1')
+
+from stand_ins import CountingSNS, InMemoryDynamoDB, item_size  # noqa: E402
+
+# Replays synthetic Kinesis batches through process_cryptostream's
+# lambda_handler against in-memory DynamoDB/SNS and reports throughput, remote
+# calls, item sizes and latency for each coin count and batch size.
+#
+#   python benchmarks/bench_process_cryptostream.py --coins 10 100 --batch-sizes 1 100
+#   python benchmarks/bench_process_cryptostream.py --output bench.json
+#   python benchmarks/bench_process_cryptostream.py --baseline bench.json --max-regression 0.2
+
+START_TIME = datetime(2024, 5, 1, tzinfo=timezone.utc)
+
+
+def kinesis_record(payload, sequence_number, shard_id='shardId-000000000000'):
+    # Same shape as a Lambda Kinesis event record; decode_kinesis_record reads
+    # record['kinesis']['data']
+    return {
+        'eventID': f"{shard_id}:{sequence_number}",
+        'eventSource': 'aws:kinesis',
+        'kinesis': {
+            'partitionKey': payload['id'],
+            'sequenceNumber': str(sequence_number),
+            'data': base64.b64encode(json.dumps(payload).encode('utf-8')).decode('ascii')
+        }
+    }
+
+
+def synthetic_ticks(num_coins, ticks_per_coin, seed=7, start_minute=0):
+    # One tick per coin per minute: a noisy sine around a per-coin base price
+    rng = random.Random(seed)
+    bases = [rng.uniform(0.05, 60000) for _ in range(num_coins)]
+    ticks = []
+    for minute in range(start_minute, start_minute + ticks_per_coin):
+        timestamp = (START_TIME + timedelta(minutes=minute)).isoformat().replace('+00:00', '.000Z')
+        for coin, base in enumerate(bases):
+            price = base * (1 + 0.05 * math.sin(minute / (30 + coin % 17)) + rng.uniform(-0.002, 0.002))
+            ticks.append({
+                'id': f"coin-{coin}",
+                'symbol': f"c{coin}",
+                'price': round(price, 6),
+                'market_cap': round(price * 1e6),
+                'volume': round(price * 2e4),
+                'timestamp': timestamp
+            })
+    return ticks
+
+
+def kinesis_batches(ticks, batch_size, first_sequence=1):
+    records = [kinesis_record(tick, first_sequence + i) for i, tick in enumerate(ticks)]
+    return [records[i:i + batch_size] for i in range(0, len(records), batch_size)]
+
+
+def load_processor(dynamodb, sns, batch_processing, cache_size):
+    import process_cryptostream_lambda_function as processor
+    from coin_state import StateCache
+
+    processor.table = dynamodb.Table(processor.TABLE_NAME)
+    if processor.EVENTS_TABLE:
+        processor.events_table = dynamodb.Table(processor.EVENTS_TABLE)
+    processor.sns_client = lambda: sns
+    processor.BATCH_PROCESSING = batch_processing
+    processor.state_cache = StateCache(cache_size)
+    return processor
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))] if ordered else 0.0
+
+
+def run_scenario(num_coins, batch_size, ticks_per_coin, warmup_ticks, batch_processing, cache_size):
+    dynamodb = InMemoryDynamoDB()
+    dynamodb.create_table(os.environ['DYNAMODB_TABLE'])
+    if os.environ.get('EVENTS_TABLE'):
+        dynamodb.create_table(os.environ['EVENTS_TABLE'], ('coin_id', 'event_key'))
+    sns = CountingSNS()
+    processor = load_processor(dynamodb, sns, batch_processing, cache_size)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        # Fill every coin's price history before measuring
+        for batch in kinesis_batches(synthetic_ticks(num_coins, warmup_ticks), 500):
+            processor.lambda_handler({'Records': batch}, None)
+
+        dynamodb.metrics.reset()
+        sns.published = sns.bytes = 0
+        batches = kinesis_batches(
+            synthetic_ticks(num_coins, ticks_per_coin, start_minute=warmup_ticks),
+            batch_size,
+            first_sequence=num_coins * warmup_ticks + 1
+        )
+
+        per_record = []
+        invocations = []
+        started = time.perf_counter()
+        for batch in batches:
+            t0 = time.perf_counter()
+            processor.lambda_handler({'Records': batch}, None)
+            elapsed = time.perf_counter() - t0
+            invocations.append(elapsed)
+            per_record.extend([elapsed / len(batch)] * len(batch))
+        total = time.perf_counter() - started
+
+    records = len(per_record)
+    calls = dynamodb.metrics.calls
+    sizes = [item_size(item) for item in dynamodb.Table(os.environ['DYNAMODB_TABLE']).items.values()]
+    return {
+        'coins': num_coins,
+        'batch_size': batch_size,
+        'records': records,
+        'records_per_sec': round(records / total, 1),
+        'dynamodb_calls_per_record': round(sum(calls.values()) / records, 4),
+        'dynamodb_calls': dict(calls),
+        'read_bytes_per_record': round(dynamodb.metrics.read_bytes / records, 1),
+        'write_bytes_per_record': round(dynamodb.metrics.write_bytes / records, 1),
+        'item_size_avg': round(statistics.mean(sizes)) if sizes else 0,
+        'item_size_max': max(sizes, default=0),
+        'sns_publishes': sns.published,
+        'record_latency_p50_ms': round(percentile(per_record, 50) * 1000, 3),
+        'record_latency_p99_ms': round(percentile(per_record, 99) * 1000, 3),
+        'invocation_latency_p99_ms': round(percentile(invocations, 99) * 1000, 3)
+    }
+
+
+def check_regressions(results, baseline, max_regression):
+    # A scenario regresses if throughput drops or remote calls per record grow
+    # by more than max_regression compared with the baseline run
+    failures = []
+    previous = {(r['coins'], r['batch_size']): r for r in baseline}
+    for result in results:
+        before = previous.get((result['coins'], result['batch_size']))
+        if not before:
+            continue
+        name = f"{result['coins']} coins x batch {result['batch_size']}"
+        if result['records_per_sec'] < before['records_per_sec'] * (1 - max_regression):
+            failures.append(f"{name}: {result['records_per_sec']} records/s vs {before['records_per_sec']}")
+        if result['dynamodb_calls_per_record'] > before['dynamodb_calls_per_record'] * (1 + max_regression):
+            failures.append(f"{name}: {result['dynamodb_calls_per_record']} DynamoDB calls/record "
+                            f"vs {before['dynamodb_calls_per_record']}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput benchmark for process_cryptostream")
+    parser.add_argument('--coins', type=int, nargs='+', default=[10, 100])
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 100, 500])
+    parser.add_argument('--ticks', type=int, default=20, help="measured ticks per coin")
+    parser.add_argument('--warmup-ticks', type=int, default=250, help="ticks per coin replayed before measuring")
+    parser.add_argument('--per-record', action='store_true', help="use the per-record path instead of batch mode")
+    parser.add_argument('--cache-size', type=int, default=int(os.environ.get('STATE_CACHE_SIZE', '256')))
+    parser.add_argument('--output', help="write results as JSON")
+    parser.add_argument('--baseline', help="JSON results of an earlier run to compare against")
+    parser.add_argument('--max-regression', type=float, default=0.2)
+    args = parser.parse_args()
+
+    results = []
+    for num_coins in args.coins:
+        for batch_size in args.batch_sizes:
+            result = run_scenario(num_coins, batch_size, args.ticks, args.warmup_ticks,
+                                  not args.per_record, args.cache_size)
+            results.append(result)
+            print(f"{num_coins:>5} coins  batch {batch_size:>4}  {result['records_per_sec']:>9.1f} rec/s  "
+                  f"{result['dynamodb_calls_per_record']:>7.3f} ddb calls/rec  "
+                  f"item {result['item_size_avg']:>7} B  "
+                  f"p50 {result['record_latency_p50_ms']:.3f} ms  p99 {result['record_latency_p99_ms']:.3f} ms")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            failures = check_regressions(results, json.load(f), args.max_regression)
+        for failure in failures:
+            print(f"❌ Regression: {failure}")
+        if failures:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bench_process_cryptostream import percentile  # noqa: E402
+from mock_services import MARKETS_PATH, add_mock_arguments, mock_state, start_mock_server  # noqa: E402
+from stand_ins import CountingKinesis  # noqa: E402
+
+# Drives fetch_prices and sns_to_discord_forwarder against the local
+# CoinGecko/Discord stand-in (benchmarks/mock_services.py) and reports
+# throughput, tail latency, retries and how many TCP connections the clients
+# opened. Kinesis is an in-memory stand-in. The functions' own environment
+# variables (FETCH_CONCURRENCY, DISCORD_RATE_LIMIT, ...) apply as usual.
+#
+#   python benchmarks/load_generator.py --target fetch --invocations 20 --fetch-mode ids --coins 5000
+#   python benchmarks/load_generator.py --target forward --alerts 40 --error-rate 0.05
+#   python benchmarks/load_generator.py --concurrency 4 --output load.json
+
+
+def configure(base_url, args):
+    # Must run before the handlers are imported: they read their settings then
+    os.environ['COINGECKO_MARKETS_URL'] = base_url + MARKETS_PATH
+    os.environ['DISCORD_WEBHOOK_URL'] = base_url + '/api/webhooks/1/token'
+    os.environ['FETCH_MODE'] = args.fetch_mode
+    os.environ.setdefault('METRICS_SAMPLE_RATE', '0')
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'ap-southeast-1')
+    # The real per-minute budget would turn the run into a rate-limit test
+    os.environ.setdefault('COINGECKO_RATE_LIMIT', '6000')
+    if args.fetch_mode == 'ids':
+        universe = tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False)
+        universe.write('\n'.join(f"coin-{i}" for i in range(args.coins)))
+        universe.close()
+        os.environ['COIN_UNIVERSE_FILE'] = universe.name
+    else:
+        os.environ['TARGET_COINS'] = '*'
+        os.environ.setdefault('MARKETS_PAGES', str(max(1, -(-args.coins // 250))))
+
+
+def run_invocations(handler, events, concurrency):
+    # Returns the responses and each invocation's latency in seconds
+    def invoke(event):
+        started = time.perf_counter()
+        response = handler(event, None)
+        return response, time.perf_counter() - started
+
+    with contextlib.redirect_stdout(io.StringIO()), ThreadPoolExecutor(max_workers=concurrency) as executor:
+        started = time.perf_counter()
+        results = list(executor.map(invoke, events))
+        total = time.perf_counter() - started
+    return [response for response, _ in results], [latency for _, latency in results], total
+
+
+def summarize(name, latencies, total, before, after, extra):
+    server = {key: after.get(key, 0) - before.get(key, 0) for key in after}
+    return {
+        'target': name,
+        'invocations': len(latencies),
+        'seconds': round(total, 3),
+        'invocation_p50_ms': round(percentile(latencies, 50) * 1000, 1),
+        'invocation_p99_ms': round(percentile(latencies, 99) * 1000, 1),
+        'requests': server.get('markets_requests', 0) + server.get('webhook_requests', 0),
+        'connections': server.get('connections', 0),
+        'throttled': server.get('status_429', 0),
+        'server_errors': server.get('status_500', 0) + server.get('status_503', 0),
+        'not_modified': server.get('status_304', 0),
+        **extra
+    }
+
+
+def load_fetch(state, args):
+    import fetch_prices_lambda_function as fetcher
+
+    kinesis = CountingKinesis()
+    fetcher.kinesis_client = lambda: kinesis
+    events = [{'worker': i % args.workers, 'workers': args.workers} for i in range(args.invocations)]
+    before = state.snapshot()
+    responses, latencies, total = run_invocations(fetcher.lambda_handler, events, args.concurrency)
+    return summarize('fetch_prices', latencies, total, before, state.snapshot(), {
+        'records_sent': kinesis.records,
+        'records_per_sec': round(kinesis.records / total, 1),
+        'failed_invocations': sum(1 for response in responses if response['statusCode'] != 200)
+    })
+
+
+def load_forward(state, args):
+    import sns_to_discord_forwarder_lambda_function as forwarder
+
+    def alert(i):
+        message = {
+            'coin': f"coin-{i}",
+            'signal': 'EMA: Golden Cross, SMA: None',
+            'trend_status': 'EMA: Buy, SMA: Hold',
+            'price': '1.5',
+            'ema_short': '1.4',
+            'ema_long': '1.3',
+            'timestamp': '2024-05-01T07:00:00+07:00'
+        }
+        return {'Sns': {'Message': json.dumps(message)}}
+
+    events = [{'Records': [alert(i * args.alerts + j) for j in range(args.alerts)]} for i in range(args.invocations)]
+    before = state.snapshot()
+    responses, latencies, total = run_invocations(forwarder.lambda_handler, events, args.concurrency)
+    stats = [json.loads(response['body']) for response in responses]
+    delivered = sum(s['delivered_alerts'] for s in stats)
+    return summarize('sns_to_discord_forwarder', latencies, total, before, state.snapshot(), {
+        'alerts_delivered': delivered,
+        'alerts_dropped': sum(s['dropped_alerts'] for s in stats),
+        'alerts_per_sec': round(delivered / total, 1),
+        'retries': sum(s['retries'] for s in stats),
+        'alert_latency_p99_ms': max((s['latency_p99_ms'] for s in stats), default=0)
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load generator for the HTTP-facing Lambda functions")
+    parser.add_argument('--target', choices=['fetch', 'forward', 'both'], default='both')
+    parser.add_argument('--invocations', type=int, default=10)
+    parser.add_argument('--concurrency', type=int, default=1, help="invocations running at once")
+    parser.add_argument('--fetch-mode', choices=['pages', 'ids'], default='pages')
+    parser.add_argument('--workers', type=int, default=1, help="fetcher workers the ids universe is split over")
+    parser.add_argument('--alerts', type=int, default=25, help="SNS records per forwarder invocation")
+    parser.add_argument('--output', help="write results as JSON")
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    state = mock_state(args)
+    server, base_url = start_mock_server(state)
+    configure(base_url, args)
+
+    results = []
+    if args.target in ('fetch', 'both'):
+        results.append(load_fetch(state, args))
+    if args.target in ('forward', 'both'):
+        results.append(load_forward(state, args))
+    server.shutdown()
+
+    for result in results:
+        rate = result.get('records_per_sec', result.get('alerts_per_sec'))
+        print(f"{result['target']:<26} {result['invocations']:>4} inv  {rate:>9.1f} items/s  "
+              f"p50 {result['invocation_p50_ms']:>8.1f} ms  p99 {result['invocation_p99_ms']:>8.1f} ms  "
+              f"{result['requests']:>5} requests over {result['connections']:>3} connections  "
+              f"429 {result['throttled']:>3}  5xx {result['server_errors']:>3}  304 {result['not_modified']:>3}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,247 @@
+import argparse
+import json
+import math
+import random
+import threading
+import time
+import zlib
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Local stand-in for the two HTTPS APIs the Lambda functions call:
+#
+#   GET  /api/v3/coins/markets   CoinGecko markets, by page or by ?ids=, with
+#                                ETags and prices that move every
+#                                --update-interval seconds
+#   POST /api/webhooks/<id>/<token>
+#                                Discord webhook with a per-webhook fixed
+#                                window and X-RateLimit-* headers
+#
+# Both add --latency-ms (+/- --jitter-ms) to every response and fail a share
+# of requests with 429 or 5xx. GET /stats returns the request counters.
+#
+#   python benchmarks/mock_services.py --port 8080 --latency-ms 40 --error-rate 0.02 --throttle-rate 0.05
+#   COINGECKO_MARKETS_URL=http://127.0.0.1:8080/api/v3/coins/markets
+#   DISCORD_WEBHOOK_URL=http://127.0.0.1:8080/api/webhooks/1/token
+
+MARKETS_PATH = '/api/v3/coins/markets'
+WEBHOOKS_PATH = '/api/webhooks/'
+
+
+class MockState:
+    def __init__(self, coins=1000, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0, throttle_rate=0.0,
+                 retry_after=1, update_interval=60.0, webhook_limit=5, webhook_period=2.0, seed=7):
+        self.coins = coins
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.update_interval = update_interval
+        self.webhook_limit = webhook_limit
+        self.webhook_period = webhook_period
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = Counter()
+        # Webhook path -> (requests left, window end)
+        self.windows = {}
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.stats[name] += value
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.stats)
+
+    def delay(self):
+        with self.lock:
+            latency = self.latency_ms + self.rng.uniform(-self.jitter_ms, self.jitter_ms)
+        if latency > 0:
+            time.sleep(latency / 1000)
+
+    def failure(self):
+        # None, 429 or a 5xx status, drawn for one request
+        with self.lock:
+            roll = self.rng.random()
+        if roll < self.throttle_rate:
+            return 429
+        if roll < self.throttle_rate + self.error_rate:
+            return 503 if roll < self.throttle_rate + self.error_rate / 2 else 500
+        return None
+
+    def take_webhook_slot(self, path):
+        # Returns (allowed, remaining, seconds until the window resets)
+        with self.lock:
+            now = time.monotonic()
+            remaining, reset_at = self.windows.get(path, (self.webhook_limit, now + self.webhook_period))
+            if now >= reset_at:
+                remaining, reset_at = self.webhook_limit, now + self.webhook_period
+            allowed = remaining > 0
+            if allowed:
+                remaining -= 1
+            self.windows[path] = (remaining, reset_at)
+            return allowed, remaining, reset_at - now
+
+    def market(self, coin_id, epoch):
+        # Deterministic price walk per coin, moving once per update interval
+        seed = zlib.crc32(coin_id.encode('utf-8'))
+        base = 0.05 + seed % 60000
+        price = base * (1 + 0.05 * math.sin(epoch / (30 + seed % 17)))
+        updated = datetime.fromtimestamp(epoch * self.update_interval, timezone.utc)
+        return {
+            'id': coin_id,
+            'symbol': coin_id.replace('coin-', 'c'),
+            'name': coin_id.title(),
+            'current_price': round(price, 6),
+            'market_cap': round(price * 1e6),
+            'total_volume': round(price * 2e4),
+            'last_updated': updated.strftime('%Y-%m-%dT%H:%M:%S.000Z')
+        }
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    # Keep-alive, so the clients' connection reuse shows up in `connections`
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.server.state.count('connections')
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, payload=None, headers=None):
+        body = json.dumps(payload).encode('utf-8') if payload is not None else b''
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if payload is not None:
+            self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.state.count(f'status_{status}')
+
+    def do_GET(self):
+        state = self.server.state
+        url = urlparse(self.path)
+        if url.path == '/stats':
+            self.send_json(200, state.snapshot())
+            return
+        if url.path != MARKETS_PATH:
+            self.send_json(404, {'error': 'not found'})
+            return
+
+        state.count('markets_requests')
+        state.delay()
+        status = state.failure()
+        if status == 429:
+            self.send_json(429, {'status': {'error_code': 429, 'error_message': "You've exceeded the Rate Limit"}},
+                           {'Retry-After': str(state.retry_after)})
+            return
+        if status:
+            self.send_json(status, {'error': 'upstream unavailable'})
+            return
+
+        query = parse_qs(url.query)
+        per_page = min(int(query.get('per_page', ['100'])[0]), 250)
+        page = int(query.get('page', ['1'])[0])
+        if 'ids' in query:
+            coin_ids = [coin_id for coin_id in query['ids'][0].split(',') if coin_id][:per_page]
+        else:
+            first = (page - 1) * per_page
+            coin_ids = [f"coin-{i}" for i in range(first, min(first + per_page, state.coins))]
+
+        epoch = int(time.time() // state.update_interval)
+        etag = f'W/"{zlib.crc32(url.query.encode("utf-8")):08x}-{epoch}"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_json(304, headers={'ETag': etag})
+            return
+        self.send_json(200, [state.market(coin_id, epoch) for coin_id in coin_ids], {'ETag': etag})
+
+    def do_POST(self):
+        state = self.server.state
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if not self.path.startswith(WEBHOOKS_PATH):
+            self.send_json(404, {'error': 'not found'})
+            return
+
+        state.count('webhook_requests')
+        state.count('webhook_bytes', len(body))
+        state.delay()
+        allowed, remaining, reset_after = state.take_webhook_slot(self.path)
+        headers = {
+            'X-RateLimit-Limit': str(state.webhook_limit),
+            'X-RateLimit-Remaining': str(remaining),
+            'X-RateLimit-Reset-After': f"{reset_after:.3f}"
+        }
+        if not allowed:
+            self.send_json(429, {'message': 'You are being rate limited.', 'retry_after': round(reset_after, 3),
+                                 'global': False}, headers)
+            return
+
+        status = state.failure()
+        if status and status != 429:
+            self.send_json(status, {'message': 'Internal Server Error'}, headers)
+            return
+        try:
+            embeds = len(json.loads(body).get('embeds', []))
+        except ValueError:
+            self.send_json(400, {'message': 'Cannot send an empty message'}, headers)
+            return
+        state.count('webhook_embeds', embeds)
+        self.send_response(204)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+        state.count('status_204')
+
+
+def start_mock_server(state, host='127.0.0.1', port=0):
+    # Serves on a daemon thread; returns the server and its base URL
+    server = ThreadingHTTPServer((host, port), MockHandler)
+    server.daemon_threads = True
+    server.state = state
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def add_mock_arguments(parser):
+    parser.add_argument('--coins', type=int, default=1000, help="size of the mock coin universe")
+    parser.add_argument('--latency-ms', type=float, default=20.0)
+    parser.add_argument('--jitter-ms', type=float, default=10.0)
+    parser.add_argument('--error-rate', type=float, default=0.01, help="share of requests answered with a 5xx")
+    parser.add_argument('--throttle-rate', type=float, default=0.02, help="share of markets requests answered 429")
+    parser.add_argument('--retry-after', type=int, default=1, help="Retry-After of a markets 429, in seconds")
+    parser.add_argument('--update-interval', type=float, default=60.0, help="seconds between price moves")
+    parser.add_argument('--webhook-limit', type=int, default=5, help="webhook requests per window")
+    parser.add_argument('--webhook-period', type=float, default=2.0, help="webhook window in seconds")
+
+
+def mock_state(args):
+    return MockState(args.coins, args.latency_ms, args.jitter_ms, args.error_rate, args.throttle_rate,
+                     args.retry_after, args.update_interval, args.webhook_limit, args.webhook_period)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local CoinGecko and Discord stand-in")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    server, base_url = start_mock_server(mock_state(args), args.host, args.port)
+    print(f"🧪 Serving {base_url}{MARKETS_PATH} and {base_url}{WEBHOOKS_PATH}<id>/<token>")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
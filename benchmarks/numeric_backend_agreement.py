@@ -0,0 +1,124 @@
+import argparse
+import os
+import random
+import sys
+import time
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from indicator_engine import INDICATORS, IndicatorEngine, NUMERIC_BACKENDS, SIGNAL_RULES, detect_signal, to_decimal  # noqa: E402
+
+# Checks that the float backend computes the same indicator values and makes
+# the same crossover decisions as the exact Decimal backend, and times the
+# engine updates of both. Every configured indicator and signal rule is
+# replayed tick by tick the way process_tick does it: compare against the
+# previous values as stored (rounded to 5 decimals), with the engine saved and
+# restored every few ticks.
+#
+#   python benchmarks/numeric_backend_agreement.py --ticks 20000 --series 20
+
+
+def random_walk(rng, ticks, base, volatility):
+    prices = []
+    volumes = []
+    price = base
+    for _ in range(ticks):
+        price *= 1 + rng.gauss(0, volatility)
+        prices.append(Decimal(repr(round(price, 8 if base < 1 else 2))))
+        volumes.append(Decimal(rng.randint(10 ** 5, 10 ** 9)))
+    return prices, volumes
+
+
+def replay(prices, volumes, number, restore_every):
+    names = tuple(INDICATORS)
+    engine = IndicatorEngine(number, names)
+    history = []
+    stored = {}
+    signals = []
+    values = []
+    for index, price in enumerate(prices):
+        timestamp = f"2024-05-{1 + index // 1440:02d}T{index % 1440 // 60:02d}:{index % 60:02d}"
+        history.append({'price': price, 'timestamp': timestamp})
+        history = history[-500:]
+        if restore_every and index and index % restore_every == 0:
+            engine = IndicatorEngine.restore(engine.to_state(), history[:-1], number, names)
+        current = engine.update(price, timestamp, volumes[index])
+        tick_signals = {}
+        for prefix, rule in SIGNAL_RULES.items():
+            fast, slow = current[rule['fast']], current[rule['slow']]
+            if fast is None or slow is None:
+                continue
+            prev_fast = number(stored[rule['fast']]) if rule['fast'] in stored else fast
+            prev_slow = number(stored[rule['slow']]) if rule['slow'] in stored else slow
+            tick_signals[prefix] = detect_signal(fast, slow, prev_fast, prev_slow)
+        signals.append(tick_signals)
+        values.append(current)
+        stored = {name: str(round(to_decimal(value), 5)) for name, value in current.items() if value is not None}
+    return signals, values
+
+
+def time_updates(prices, volumes, number):
+    engine = IndicatorEngine(number, tuple(INDICATORS))
+    started = time.perf_counter()
+    for index, price in enumerate(prices):
+        engine.update(price, index, volumes[index])
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare Decimal and float indicator backends")
+    parser.add_argument('--ticks', type=int, default=5000)
+    parser.add_argument('--series', type=int, default=10)
+    parser.add_argument('--restore-every', type=int, default=97)
+    parser.add_argument('--tolerance', type=float, default=1e-9, help="max indicator difference, relative to the price")
+    parser.add_argument('--seed', type=int, default=11)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    timings = {name: 0.0 for name in NUMERIC_BACKENDS}
+    disagreements = 0
+    near_ties = 0
+    max_relative = 0.0
+    for series in range(args.series):
+        base = rng.choice([0.00002, 0.35, 2.5, 180, 3200, 65000])
+        prices, volumes = random_walk(rng, args.ticks, base, rng.choice([0.0005, 0.002, 0.01]))
+
+        results = {}
+        for name, number in NUMERIC_BACKENDS.items():
+            results[name] = replay(prices, volumes, number, args.restore_every)
+            timings[name] += time_updates(prices, volumes, number)
+
+        exact_signals, exact_values = results['decimal']
+        fast_signals, fast_values = results['float']
+        for index, (exact, fast) in enumerate(zip(exact_values, fast_values)):
+            # Differences are relative to the price, since MACD and the
+            # histogram hover around zero
+            scale = abs(float(prices[index]))
+            for name, value in exact.items():
+                if value is not None:
+                    max_relative = max(max_relative, abs(float(value) - fast[name]) / scale)
+            for prefix, signal in exact_signals[index].items():
+                if fast_signals[index].get(prefix) == signal:
+                    continue
+                # Only acceptable when the two lines are equal to within float precision
+                rule = SIGNAL_RULES[prefix]
+                if abs(float(exact[rule['fast']] - exact[rule['slow']])) <= args.tolerance * scale:
+                    near_ties += 1
+                else:
+                    disagreements += 1
+
+    total_ticks = args.ticks * args.series
+    for name, seconds in timings.items():
+        print(f"{name:>8}: {total_ticks / seconds:>10.0f} engine updates/s")
+    print(f"max indicator difference (relative to price): {max_relative:.3e}")
+    print(f"signal disagreements: {disagreements} (+{near_ties} at exact ties) over {total_ticks} ticks")
+
+    if disagreements or max_relative > args.tolerance:
+        print("❌ float backend disagrees with decimal beyond tolerance")
+        sys.exit(1)
+    print("✅ float backend agrees with decimal")
+
+
+if __name__ == '__main__':
+    main()
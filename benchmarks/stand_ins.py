@@ -0,0 +1,268 @@
+import copy
+import json
+import re
+import threading
+from collections import Counter
+from decimal import Decimal
+
+from boto3.dynamodb.types import Binary, TypeDeserializer, TypeSerializer
+from botocore.exceptions import ClientError
+
+# In-memory DynamoDB, SNS and Kinesis stand-ins for running the Lambda
+# functions locally. They implement only the calls and expression shapes the
+# functions issue (DynamoDB through aws_clients.DynamoDBTable), and count calls
+# and bytes.
+
+serializer = TypeSerializer()
+deserializer = TypeDeserializer()
+
+
+def attribute_size(value):
+    # Roughly DynamoDB's item size rules: strings and binaries by length,
+    # numbers ~1 byte per 2 digits, 3 bytes per list/map plus 1 per element
+    if isinstance(value, str):
+        return len(value.encode('utf-8'))
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, Binary):
+        return len(value.value)
+    if isinstance(value, bool) or value is None:
+        return 1
+    if isinstance(value, (int, float, Decimal)):
+        return len(str(value).lstrip('-').replace('.', '')) // 2 + 1
+    if isinstance(value, dict):
+        return 3 + sum(len(k) + attribute_size(v) + 1 for k, v in value.items())
+    if isinstance(value, (list, tuple, set)):
+        return 3 + sum(attribute_size(v) + 1 for v in value)
+    return len(json.dumps(value, default=str))
+
+
+def item_size(item):
+    return sum(len(name) + attribute_size(value) for name, value in item.items())
+
+
+def _client_error(code, operation, **extra):
+    return ClientError({'Error': {'Code': code, 'Message': code}, **extra}, operation)
+
+
+class Metrics:
+    def __init__(self):
+        self.calls = Counter()
+        self.read_bytes = 0
+        self.write_bytes = 0
+
+    def reset(self):
+        self.calls.clear()
+        self.read_bytes = 0
+        self.write_bytes = 0
+
+
+class InMemoryTable:
+    def __init__(self, name, key_names, metrics, resource=None):
+        self.name = self.table_name = name
+        self.key_names = key_names
+        self.metrics = metrics
+        self.items = {}
+        self.client = resource or InMemoryDynamoDB(metrics)
+
+    def _key(self, key):
+        return tuple(key[name] for name in self.key_names)
+
+    def serialize(self, values):
+        return {name: serializer.serialize(value) for name, value in values.items()}
+
+    # Condition and update expressions, limited to the forms this project writes
+    def _condition_holds(self, item, condition, names, values):
+        if not condition:
+            return True
+        for clause in condition.split(' OR '):
+            clause = clause.strip()
+            match = re.fullmatch(r'attribute_not_exists\((#?\w+)\)', clause)
+            if match:
+                if names.get(match.group(1), match.group(1)) not in item:
+                    return True
+                continue
+            match = re.fullmatch(r'(#?\w+)\s*=\s*(:\w+)', clause)
+            if match and item.get(names.get(match.group(1), match.group(1))) == values[match.group(2)]:
+                return True
+        return False
+
+    def _apply_update(self, item, expression, names, values):
+        # Returns the top-level attributes the update touched
+        touched = {}
+        for action, body in re.findall(r'(SET|REMOVE|ADD)\s+(.*?)\s*(?=\b(?:SET|REMOVE|ADD)\b|$)', expression, re.S):
+            for clause in re.split(r',\s*(?![^()]*\))', body):
+                if not clause.strip():
+                    continue
+                if action == 'REMOVE':
+                    item.pop(names.get(clause.strip(), clause.strip()), None)
+                    continue
+                path, value = re.split(r'\s*=\s*|\s+', clause.strip(), maxsplit=1)
+                path = [names.get(part, part) for part in path.split('.')]
+                match = re.fullmatch(r'if_not_exists\((#?\w+),\s*(:\w+)\)', value)
+                if match:
+                    value = item.get(names.get(match.group(1), match.group(1)), values[match.group(2)])
+                else:
+                    value = values[value]
+                parent = item
+                for part in path[:-1]:
+                    if not isinstance(parent.get(part), dict):
+                        raise _client_error('ValidationException', 'UpdateItem')
+                    parent = parent[part]
+                if action == 'ADD':
+                    value = parent.get(path[-1], 0) + value
+                parent[path[-1]] = copy.deepcopy(value)
+                touched[path[0]] = item[path[0]]
+        return touched
+
+    def get_item(self, Key, ConsistentRead=False):
+        self.metrics.calls['GetItem'] += 1
+        item = self.items.get(self._key(Key))
+        if item is None:
+            return {}
+        self.metrics.read_bytes += item_size(item)
+        return {'Item': copy.deepcopy(item)}
+
+    def update_item(self, Key, UpdateExpression, ConditionExpression=None,
+                    ExpressionAttributeNames=None, ExpressionAttributeValues=None, ReturnValues=None):
+        self.metrics.calls['UpdateItem'] += 1
+        touched = self._update(Key, UpdateExpression, ConditionExpression,
+                               ExpressionAttributeNames or {}, ExpressionAttributeValues or {},
+                               'ConditionalCheckFailedException', 'UpdateItem')
+        return {'Attributes': copy.deepcopy(touched)} if ReturnValues == 'UPDATED_NEW' else {}
+
+    def _update(self, key, expression, condition, names, values, error_code, operation):
+        current = self.items.get(self._key(key))
+        item = copy.deepcopy(current) if current is not None else dict(key)
+        if not self._condition_holds(current or {}, condition, names, values):
+            raise _client_error(error_code, operation)
+        touched = self._apply_update(item, expression, names, values)
+        self.metrics.write_bytes += attribute_size(values)
+        self.items[self._key(key)] = item
+        return touched
+
+    def put_item(self, Item):
+        self.metrics.calls['PutItem'] += 1
+        self.metrics.write_bytes += item_size(Item)
+        self.items[self._key(Item)] = copy.deepcopy(Item)
+
+    def batch_writer(self, overwrite_by_pkeys=None):
+        return BatchWriter(self)
+
+    def batch_get(self, keys, ConsistentRead=False):
+        self.metrics.calls['BatchGetItem'] += 1
+        found = []
+        for key in keys:
+            item = self.items.get(self._key(key))
+            if item is not None:
+                self.metrics.read_bytes += item_size(item)
+                found.append(copy.deepcopy(item))
+        return found, []
+
+    def query(self, KeyConditionExpression, ExpressionAttributeValues, ScanIndexForward=True, Limit=None,
+              ExclusiveStartKey=None, **kwargs):
+        # Supports `pk = :a AND begins_with(sk, :b)`, in one page
+        self.metrics.calls['Query'] += 1
+        match = re.fullmatch(r'\s*\w+\s*=\s*(:\w+)\s+AND\s+begins_with\(\s*\w+\s*,\s*(:\w+)\s*\)\s*',
+                             KeyConditionExpression)
+        partition = ExpressionAttributeValues[match.group(1)]
+        prefix = ExpressionAttributeValues[match.group(2)]
+        sort_name = self.key_names[-1]
+        items = sorted((item for key, item in self.items.items()
+                        if key[0] == partition and item[sort_name].startswith(prefix)),
+                       key=lambda item: item[sort_name], reverse=not ScanIndexForward)
+        return {'Items': copy.deepcopy(items[:Limit] if Limit else items)}
+
+    def scan(self, **kwargs):
+        self.metrics.calls['Scan'] += 1
+        return {'Items': copy.deepcopy(list(self.items.values()))}
+
+
+class BatchWriter:
+    def __init__(self, table):
+        self.table = table
+        self.pending = []
+
+    def put_item(self, Item):
+        self.pending.append(Item)
+        if len(self.pending) == 25:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.table.metrics.calls['BatchWriteItem'] += 1
+            for item in self.pending:
+                self.table.metrics.write_bytes += item_size(item)
+                self.table.items[self.table._key(item)] = copy.deepcopy(item)
+            self.pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
+
+
+class InMemoryDynamoDB:
+    # Holds the tables (Table) and stands in for the low-level client behind
+    # table.client (transact_write_items)
+    def __init__(self, metrics=None):
+        self.metrics = metrics or Metrics()
+        self.tables = {}
+
+    def create_table(self, name, key_names=('coin_id',)):
+        self.tables[name] = InMemoryTable(name, key_names, self.metrics, self)
+        return self.tables[name]
+
+    def Table(self, name):
+        return self.tables[name]
+
+    def transact_write_items(self, TransactItems):
+        self.metrics.calls['TransactWriteItems'] += 1
+        updates = []
+        for entry in TransactItems:
+            update = entry['Update']
+            table = self.tables[update['TableName']]
+            key = {k: deserializer.deserialize(v) for k, v in update['Key'].items()}
+            values = {k: deserializer.deserialize(v) for k, v in update.get('ExpressionAttributeValues', {}).items()}
+            updates.append((table, key, update, values))
+
+        reasons = []
+        for table, key, update, values in updates:
+            current = table.items.get(table._key(key)) or {}
+            ok = table._condition_holds(current, update.get('ConditionExpression'),
+                                        update.get('ExpressionAttributeNames', {}), values)
+            reasons.append({'Code': 'None'} if ok else {'Code': 'ConditionalCheckFailed'})
+        if any(reason['Code'] != 'None' for reason in reasons):
+            raise _client_error('TransactionCanceledException', 'TransactWriteItems', CancellationReasons=reasons)
+
+        for table, key, update, values in updates:
+            table._update(key, update['UpdateExpression'], None,
+                          update.get('ExpressionAttributeNames', {}), values, None, 'TransactWriteItems')
+        return {}
+
+
+class CountingSNS:
+    def __init__(self):
+        self.published = 0
+        self.bytes = 0
+
+    def publish(self, TopicArn, Message, Subject=None, **kwargs):
+        self.published += 1
+        self.bytes += len(Message.encode('utf-8'))
+        return {'MessageId': str(self.published)}
+
+
+class CountingKinesis:
+    def __init__(self):
+        self.calls = 0
+        self.records = 0
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+    def put_records(self, StreamName, Records):
+        with self.lock:
+            self.calls += 1
+            self.records += len(Records)
+            self.bytes += sum(len(record['Data']) for record in Records)
+        return {'FailedRecordCount': 0, 'Records': [{'SequenceNumber': str(i)} for i in range(len(Records))]}
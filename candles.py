@@ -0,0 +1,104 @@
+from datetime import datetime, timezone
+from indicator_engine import IndicatorEngine
+from price_history_codec import encode_candles, decode_candles
+
+# Candle sizes in seconds. Buckets are aligned to the tick timestamps' own
+# timezone, so daily candles start at local midnight.
+TIMEFRAMES = {
+    '1m': 60,
+    '5m': 300,
+    '15m': 900,
+    '1h': 3600,
+    '4h': 14400,
+    '1d': 86400,
+}
+
+
+def parse_timestamp(timestamp):
+    moment = datetime.fromisoformat(timestamp)
+    return moment if moment.tzinfo else moment.replace(tzinfo=timezone.utc)
+
+
+def candle_start(timestamp, seconds):
+    moment = parse_timestamp(timestamp)
+    offset = int(moment.utcoffset().total_seconds())
+    local = int(moment.timestamp()) + offset
+    start = local - local % seconds - offset
+    return datetime.fromtimestamp(start, moment.tzinfo).isoformat()
+
+
+class CandleAggregator:
+    # One coin's OHLC candles for one timeframe. Ticks only move the open
+    # candle; when a tick lands in a later bucket the open candle closes, is
+    # kept (newest `limit` closed candles) and its close is fed to the
+    # timeframe's own indicator engine.
+    #
+    # Stored as two attributes so a tick only rewrites the small one:
+    #   candles_<tf>_open  the open candle
+    #   candles_<tf>       packed closed candles, indicator state and the
+    #                      values the next crossover is detected against
+    def __init__(self, timeframe, open_item, closed_item, number, names, limit):
+        self.timeframe = timeframe
+        self.seconds = TIMEFRAMES[timeframe]
+        self.limit = limit
+        self.open = dict(open_item) if open_item else None
+        closed_item = closed_item or {}
+        packed = closed_item.get('closed')
+        self.closed = decode_candles(packed) if packed is not None else []
+        self.values = dict(closed_item.get('values', {}))
+        self.trend_status = closed_item.get('trend_status', '')
+        self.engine = IndicatorEngine.restore(closed_item.get('indicator_state'), self.close_history(), number, names)
+        self.open_changed = False
+        self.closed_changed = False
+
+    @classmethod
+    def from_state(cls, state, timeframe, number, names, limit):
+        return cls(timeframe, state.get(f'candles_{timeframe}_open'), state.get(f'candles_{timeframe}'),
+                   number, names, limit)
+
+    def close_history(self):
+        return [{'price': candle['close'], 'timestamp': candle['start']} for candle in self.closed]
+
+    def add_tick(self, price, timestamp, volume=None, late=False):
+        # Returns the candle this tick closed, if any. Ticks older than the
+        # open candle are ignored. A late tick (behind the newest one) can
+        # only widen the open candle's range.
+        start = candle_start(timestamp, self.seconds)
+        candle = self.open
+        if candle is not None and start == candle['start']:
+            candle['high'] = max(candle['high'], price)
+            candle['low'] = min(candle['low'], price)
+            if not late:
+                candle['close'] = price
+                if volume is not None:
+                    candle['volume'] = volume
+            self.open_changed = True
+            return None
+        if late or candle is not None and parse_timestamp(start) < parse_timestamp(candle['start']):
+            return None
+
+        self.open = {'start': start, 'open': price, 'high': price, 'low': price, 'close': price}
+        if volume is not None:
+            self.open['volume'] = volume
+        self.open_changed = True
+        if candle is None:
+            return None
+
+        self.closed.append(candle)
+        self.closed = self.closed[-self.limit:]
+        self.engine.update(candle['close'], candle['start'], candle.get('volume'))
+        self.closed_changed = True
+        return candle
+
+    def stage(self, state, compress=False):
+        if self.open_changed:
+            state.set(f'candles_{self.timeframe}_open', self.open)
+            self.open_changed = False
+        if self.closed_changed:
+            state.set(f'candles_{self.timeframe}', {
+                'closed': encode_candles(self.closed, compress),
+                'indicator_state': self.engine.to_state(),
+                'values': self.values,
+                'trend_status': self.trend_status
+            })
+            self.closed_changed = False
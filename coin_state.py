@@ -0,0 +1,253 @@
+from collections import OrderedDict
+from botocore.exceptions import ClientError
+from aws_clients import batch_get_all
+from price_history_codec import encode_price_history, decode_price_history
+
+# DynamoDB request limits
+BATCH_GET_LIMIT = 100
+TRANSACT_WRITE_CHUNK = 25
+
+
+class VersionConflict(Exception):
+    pass
+
+
+class CoinState:
+    # One coin's trend item, loaded once per record and changed in memory.
+    # save() writes every changed attribute in a single update_item guarded by
+    # the item's `version`, so concurrent shard invocations cannot silently
+    # overwrite each other.
+    def __init__(self, coin_id, item=None):
+        self.coin_id = coin_id
+        self.item = item or {}
+        self.version = int(self.item.get('version', 0))
+        self.dirty = set()
+        self.removed = set()
+        # In-memory companions, reused while replaying several ticks: the
+        # decoded price history, the indicator engine, the candle aggregators
+        # by timeframe and history events waiting to be written once the item
+        # is saved
+        self.history = None
+        self.engine = None
+        self.candles = {}
+        self.events = []
+
+    @classmethod
+    def load(cls, table, coin_id):
+        response = table.get_item(Key={'coin_id': coin_id}, ConsistentRead=True)
+        return cls(coin_id, response.get('Item'))
+
+    @classmethod
+    def load_many(cls, table, coin_ids):
+        # BatchGetItem in chunks of 100 keys, retrying unprocessed keys
+        items = {}
+        coin_ids = list(coin_ids)
+        for i in range(0, len(coin_ids), BATCH_GET_LIMIT):
+            keys = [{'coin_id': coin_id} for coin_id in coin_ids[i:i + BATCH_GET_LIMIT]]
+            for item in batch_get_all(table, keys, ConsistentRead=True):
+                items[item['coin_id']] = item
+        return {coin_id: cls(coin_id, items.get(coin_id)) for coin_id in coin_ids}
+
+    def get(self, name, default=None):
+        return self.item.get(name, default)
+
+    def set(self, name, value):
+        self.item[name] = value
+        self.dirty.add(name)
+        self.removed.discard(name)
+
+    def remove(self, name):
+        self.item.pop(name, None)
+        self.dirty.discard(name)
+        self.removed.add(name)
+
+    def update(self, values):
+        for name, value in values.items():
+            self.set(name, value)
+
+    def price_history(self):
+        # Reads either storage format: `price_history_packed` (Binary) or the
+        # legacy `price_history` list of {'price', 'timestamp'} maps
+        if self.history is None:
+            packed = self.item.get('price_history_packed')
+            if packed is not None:
+                self.history = decode_price_history(packed)
+            else:
+                self.history = self.item.get('price_history', [])
+        return self.history
+
+    def stage_price_history(self, history_format='list', price_format='fixed', compress=False):
+        # Writes the in-memory history in the configured format and drops the
+        # other one, so items migrate on their next save
+        history = self.price_history()
+        if history_format == 'packed':
+            self.set('price_history_packed', encode_price_history(history, price_format, compress))
+            if 'price_history' in self.item:
+                self.remove('price_history')
+        else:
+            self.set('price_history', history)
+            if 'price_history_packed' in self.item:
+                self.remove('price_history_packed')
+
+    def _update_args(self):
+        names = {'#version': 'version'}
+        values = {':expected': self.version, ':next': self.version + 1}
+        assignments = ['#version = :next']
+        for i, name in enumerate(sorted(self.dirty)):
+            names[f'#a{i}'] = name
+            values[f':v{i}'] = self.item[name]
+            assignments.append(f'#a{i} = :v{i}')
+
+        update_expression = 'SET ' + ', '.join(assignments)
+        if self.removed:
+            removals = []
+            for i, name in enumerate(sorted(self.removed)):
+                names[f'#r{i}'] = name
+                removals.append(f'#r{i}')
+            update_expression += ' REMOVE ' + ', '.join(removals)
+
+        if self.version == 0:
+            condition = 'attribute_not_exists(#version) OR #version = :expected'
+        else:
+            condition = '#version = :expected'
+
+        return {
+            'Key': {'coin_id': self.coin_id},
+            'UpdateExpression': update_expression,
+            'ConditionExpression': condition,
+            'ExpressionAttributeNames': names,
+            'ExpressionAttributeValues': values
+        }
+
+    def _mark_saved(self):
+        self.version += 1
+        self.item['version'] = self.version
+        self.dirty.clear()
+        self.removed.clear()
+
+    def save(self, table):
+        if not self.dirty and not self.removed:
+            return False
+
+        try:
+            table.update_item(**self._update_args())
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                raise VersionConflict(f"{self.coin_id} changed since version {self.version}") from e
+            raise
+
+        self._mark_saved()
+        return True
+
+    def clear_queue(self, table, name):
+        # Drops a delivered queue attribute (e.g. `pending_alerts`) without
+        # bumping the version, so the cached copy stays valid. If another
+        # invocation saved the coin since, its version still carries the queue
+        # and delivers it again, so the removal is skipped. Returns True when
+        # the attribute was removed.
+        try:
+            table.update_item(
+                Key={'coin_id': self.coin_id},
+                UpdateExpression='REMOVE #queue',
+                ConditionExpression='#version = :version',
+                ExpressionAttributeNames={'#queue': name, '#version': 'version'},
+                ExpressionAttributeValues={':version': self.version}
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False
+            raise
+        self.item.pop(name, None)
+        return True
+
+    @staticmethod
+    def save_many(table, states):
+        # Writes all changed states with TransactWriteItems, keeping the same
+        # version guard as save(). Returns the states that lost a version race
+        # so the caller can reload and replay them.
+        pending = [state for state in states if state.dirty or state.removed]
+        conflicts = []
+        for i in range(0, len(pending), TRANSACT_WRITE_CHUNK):
+            chunk = pending[i:i + TRANSACT_WRITE_CHUNK]
+            if len(chunk) == 1:
+                try:
+                    chunk[0].save(table)
+                except VersionConflict:
+                    conflicts.append(chunk[0])
+                continue
+
+            transact_items = []
+            for state in chunk:
+                args = state._update_args()
+                args['TableName'] = table.name
+                args['Key'] = table.serialize(args['Key'])
+                args['ExpressionAttributeValues'] = table.serialize(args['ExpressionAttributeValues'])
+                transact_items.append({'Update': args})
+
+            try:
+                table.client.transact_write_items(TransactItems=transact_items)
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'TransactionCanceledException':
+                    raise
+                # The whole chunk was rolled back; only the coins that failed
+                # their version check need a replay, the rest are saved alone
+                reasons = e.response.get('CancellationReasons') or [{}] * len(chunk)
+                for state, reason in zip(chunk, reasons):
+                    if reason.get('Code') == 'ConditionalCheckFailed':
+                        conflicts.append(state)
+                        continue
+                    try:
+                        state.save(table)
+                    except VersionConflict:
+                        conflicts.append(state)
+                continue
+
+            for state in chunk:
+                state._mark_saved()
+        return conflicts
+
+
+class StateCache:
+    # LRU of saved CoinStates that lives for the life of a warm container.
+    # Entries are trusted as-is: a stale one fails its version check on save,
+    # and the caller invalidates it and replays on a fresh read.
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.states = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, coin_id):
+        state = self.states.get(coin_id)
+        if state is None:
+            self.misses += 1
+            return None
+        self.states.move_to_end(coin_id)
+        self.hits += 1
+        return state
+
+    def put(self, state):
+        if self.max_size <= 0 or state.dirty or state.removed:
+            return
+        self.states[state.coin_id] = state
+        self.states.move_to_end(state.coin_id)
+        while len(self.states) > self.max_size:
+            self.states.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, coin_id):
+        if self.states.pop(coin_id, None) is not None:
+            self.invalidations += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self.states),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations
+        }
@@ -0,0 +1,374 @@
+import argparse
+import json
+import os
+from collections import Counter
+from datetime import datetime, timezone
+from decimal import Decimal
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from aws_clients import DynamoDBTable
+from coin_state import CoinState
+from trend_events import HISTORY_KINDS, iter_history
+
+# Streams the trend table into columnar files for offline analysis, one item
+# at a time, so memory stays at about one coin's data:
+#
+#   ticks/coin_id=<coin>/date=<date>/part-*.parquet     price history
+#   signals/coin_id=<coin>/date=<date>/part-*.parquet   cross histories
+#   profits/coin_id=<coin>/date=<date>/part-*.parquet   closed trades (by sell date)
+#   trend_state/part-<run>.parquet                      latest state per coin
+#
+# Dates are those of the stored timestamps (Bangkok time). Exports are
+# incremental: _export_state.json keeps, per coin, the exported item version
+# (unchanged coins are skipped), the timestamps of the last exported ticks and
+# how many entries of each history were exported. Rows are picked by when they
+# were recorded rather than by their own timestamp, so candle crosses (stamped
+# with the candle start) and late ticks inserted behind the newest one are not
+# missed. Each increment goes to a part file named after the previous version,
+# so a rerun after a failure overwrites it instead of duplicating rows. The
+# stored price history only holds the last 500 ticks, so a schedule that
+# exports more often than that keeps every tick.
+
+STATE_FILE = '_export_state.json'
+# Stored counter of each history kind, e.g. `ema_num_golden_crosses`
+COUNTERS = {'cross': 'num_crosses', 'golden_cross': 'num_golden_crosses', 'dead_cross': 'num_dead_crosses',
+            'profit': 'num_profits'}
+# Exported tick timestamps remembered per coin. The processor inserts a late
+# tick at most LATE_TICK_WINDOW (default 10) ticks behind the newest, so a
+# late tick is always newer than the oldest of these.
+TICK_OVERLAP = 64
+
+TICK_SCHEMA = pa.schema([
+    ('coin_id', pa.string()),
+    ('timestamp', pa.timestamp('us', tz='UTC')),
+    ('price', pa.float64()),
+])
+SIGNAL_SCHEMA = pa.schema([
+    ('coin_id', pa.string()),
+    ('rule', pa.string()),
+    ('kind', pa.string()),
+    ('timestamp', pa.timestamp('us', tz='UTC')),
+    ('price', pa.float64()),
+    ('signal', pa.string()),
+])
+PROFIT_SCHEMA = pa.schema([
+    ('coin_id', pa.string()),
+    ('rule', pa.string()),
+    ('trade', pa.int64()),
+    ('buy_timestamp', pa.timestamp('us', tz='UTC')),
+    ('buy_price', pa.float64()),
+    ('sell_timestamp', pa.timestamp('us', tz='UTC')),
+    ('sell_price', pa.float64()),
+    ('profit', pa.float64()),
+    ('profit_pct', pa.float64()),
+])
+# Indicator values and counters vary with the configuration, so every other
+# scalar attribute goes into `attributes` as text
+STATE_SCHEMA = pa.schema([
+    ('coin_id', pa.string()),
+    ('last_updated', pa.timestamp('us', tz='UTC')),
+    ('trend_status', pa.string()),
+    ('version', pa.int64()),
+    ('num_price_history', pa.int64()),
+    ('attributes', pa.map_(pa.string(), pa.string())),
+])
+
+
+def parse_time(timestamp):
+    moment = datetime.fromisoformat(timestamp)
+    return moment if moment.tzinfo else moment.replace(tzinfo=timezone.utc)
+
+
+def scan_items(table):
+    scan_kwargs = {}
+    while True:
+        response = table.scan(**scan_kwargs)
+        yield from response.get('Items', [])
+        if 'LastEvaluatedKey' not in response:
+            return
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def history_prefixes(item):
+    # Signal rules with a stored history, e.g. 'ema', 'sma' or 'ema_1d'
+    prefixes = set()
+    for name in item:
+        for kind in sorted(HISTORY_KINDS, key=len, reverse=True):
+            if name.endswith(f'_{kind}_history'):
+                prefixes.add(name[:-len(f'_{kind}_history')])
+                break
+    return sorted(prefixes)
+
+
+def from_events(item, events_table, prefix):
+    # With an events table the item only keeps the tail of a rule's histories,
+    # once the processor has moved its legacy lists there. Until then the
+    # item's lists are complete and the table may not hold them yet.
+    return events_table is not None and bool(item.get(f'{prefix}_history_events_migrated'))
+
+
+def history_entries(item, events_table, prefix, kind):
+    # Oldest first
+    if from_events(item, events_table, prefix):
+        return iter_history(events_table, item['coin_id'], f'{prefix}_{kind}', newest_first=False)
+    entries = item.get(f'{prefix}_{kind}_history', [])
+    return reversed(entries) if kind == 'profit' else entries
+
+
+def recorded_count(item, events_table, prefix, kind):
+    # Entries of one history that can be read now. Events still queued on the
+    # item (`pending_events`) are left for a later run.
+    count = item.get(f'{prefix}_{COUNTERS[kind]}')
+    if count is None:
+        count = len(item.get(f'{prefix}_{kind}_history', []))
+    if from_events(item, events_table, prefix):
+        count -= sum(1 for event in item.get('pending_events', []) if event[0] == f'{prefix}_{kind}')
+    return int(count)
+
+
+def new_entries(item, events_table, prefix, kind, exported, total):
+    # The total - exported entries recorded last, oldest first
+    count = total - exported
+    if count <= 0:
+        return []
+    if from_events(item, events_table, prefix):
+        newest = iter_history(events_table, item['coin_id'], f'{prefix}_{kind}', page_size=min(count, 100))
+        entries = [entry for entry, _ in zip(newest, range(count))]
+        return entries[::-1]
+    entries = item.get(f'{prefix}_{kind}_history', [])
+    return entries[:count][::-1] if kind == 'profit' else entries[-count:]
+
+
+def history_rows(item, events_table, prefix, kind, mark):
+    # Entries not exported yet and the new count for the watermark. `mark`
+    # holds the exported counts and, for watermarks written before counts
+    # were kept, `since` (the exported `last_updated`).
+    total = recorded_count(item, events_table, prefix, kind)
+    exported = mark['counts'].get(f'{prefix}_{kind}')
+    if exported is not None:
+        return new_entries(item, events_table, prefix, kind, exported, total), total
+    entries = history_entries(item, events_table, prefix, kind)
+    if mark['since'] is None:
+        return list(entries), total
+
+    def timestamp(entry):
+        return entry.get(f'{prefix}_dead_cross_history_last', {}).get('timestamp') if kind == 'profit' \
+            else entry.get('timestamp')
+    return [entry for entry in entries if timestamp(entry) and parse_time(timestamp(entry)) > mark['since']], total
+
+
+def tick_rows(state, mark):
+    # Ticks missing from the remembered timestamps and newer than the oldest
+    # of them, which includes late ticks inserted among already exported ones
+    recent = mark['ticks']
+    floor = min((parse_time(timestamp) for timestamp in recent), default=None)
+    seen = set(recent)
+    for entry in state.price_history():
+        moment = parse_time(entry['timestamp'])
+        if recent:
+            if moment < floor or entry['timestamp'] in seen:
+                continue
+        elif mark['since'] is not None and moment <= mark['since']:
+            continue
+        yield entry['timestamp'][:10], {'coin_id': state.coin_id, 'timestamp': moment,
+                                        'price': float(entry['price'])}
+
+
+def signal_rows(item, events_table, mark, counts):
+    for prefix in history_prefixes(item):
+        for kind in ('cross', 'golden_cross', 'dead_cross'):
+            entries, counts[f'{prefix}_{kind}'] = history_rows(item, events_table, prefix, kind, mark)
+            for entry in entries:
+                moment = parse_time(entry['timestamp'])
+                yield entry['timestamp'][:10], {
+                    'coin_id': item['coin_id'],
+                    'rule': prefix,
+                    'kind': kind,
+                    'timestamp': moment,
+                    'price': float(entry['price']),
+                    'signal': entry.get('signal')
+                }
+
+
+def profit_rows(item, events_table, mark, counts):
+    for prefix in history_prefixes(item):
+        entries, counts[f'{prefix}_profit'] = history_rows(item, events_table, prefix, 'profit', mark)
+        for entry in entries:
+            sell = entry.get(f'{prefix}_dead_cross_history_last', {})
+            buy = entry.get(f'{prefix}_golden_cross_history_last') or {}
+            if not sell.get('timestamp'):
+                continue
+            moment = parse_time(sell['timestamp'])
+            yield sell['timestamp'][:10], {
+                'coin_id': item['coin_id'],
+                'rule': prefix,
+                'trade': int(entry.get('num_getprofit', 0)),
+                'buy_timestamp': parse_time(buy['timestamp']) if buy.get('timestamp') else None,
+                'buy_price': float(buy['price']) if buy.get('price') is not None else None,
+                'sell_timestamp': moment,
+                'sell_price': float(sell['price']),
+                'profit': float(entry[f'{prefix}_profit']),
+                'profit_pct': float(entry[f'{prefix}_profit_percentage'])
+            }
+
+
+def state_row(item):
+    fixed = {'coin_id', 'last_updated', 'trend_status', 'version', 'num_price_history'}
+    return {
+        'coin_id': item['coin_id'],
+        'last_updated': parse_time(item['last_updated']),
+        'trend_status': item.get('trend_status'),
+        'version': int(item.get('version', 0)),
+        'num_price_history': int(item.get('num_price_history', 0)),
+        'attributes': [(name, str(value)) for name, value in sorted(item.items())
+                       if name not in fixed and isinstance(value, (str, Decimal, bool, int, float))]
+    }
+
+
+def write_file(path, table, file_format):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if file_format == 'arrow':
+        # Arrow IPC files can be memory-mapped as they are
+        with pa.OSFile(path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    else:
+        pq.write_table(table, path)
+
+
+def write_partitions(root, dataset, coin_id, rows, schema, part, file_format):
+    # rows yields (date, row) for one coin; one file per date. Returns the row count.
+    by_date = {}
+    for date, row in rows:
+        by_date.setdefault(date, []).append(row)
+    for date, date_rows in by_date.items():
+        path = os.path.join(root, dataset, f"coin_id={coin_id}", f"date={date}", f"{part}.{file_format}")
+        write_file(path, pa.Table.from_pylist(date_rows, schema=schema), file_format)
+    return sum(len(date_rows) for date_rows in by_date.values())
+
+
+class BatchedWriter:
+    # One file written in row groups of batch_rows, for the per-coin states
+    def __init__(self, path, schema, file_format, batch_rows):
+        self.path = path
+        self.schema = schema
+        self.file_format = file_format
+        self.batch_rows = batch_rows
+        self.rows = []
+        self.writer = self.sink = None
+
+    def write(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_rows:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        if self.writer is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            if self.file_format == 'arrow':
+                self.sink = pa.OSFile(self.path, 'wb')
+                self.writer = pa.ipc.new_file(self.sink, self.schema)
+            else:
+                self.writer = pq.ParquetWriter(self.path, self.schema)
+        self.writer.write_table(pa.Table.from_pylist(self.rows, schema=self.schema))
+        self.rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
+        if self.writer is not None:
+            self.writer.close()
+        if self.sink is not None:
+            self.sink.close()
+
+
+def load_watermarks(root):
+    try:
+        with open(os.path.join(root, STATE_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def coin_mark(watermark):
+    # Earlier exports stored only the coin's `last_updated`
+    if isinstance(watermark, str):
+        return {'version': None, 'since': parse_time(watermark), 'ticks': [], 'counts': {}}
+    watermark = watermark or {}
+    return {'version': watermark.get('version'), 'since': None, 'ticks': watermark.get('ticks', []),
+            'counts': watermark.get('counts', {})}
+
+
+def save_watermarks(root, watermarks):
+    path = os.path.join(root, STATE_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(watermarks, f, indent=1, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def export_table(table, root, events_table=None, file_format='parquet', full=False, batch_rows=10000):
+    watermarks = {} if full else load_watermarks(root)
+    run = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    counts = Counter()
+    os.makedirs(root, exist_ok=True)
+
+    state_path = os.path.join(root, 'trend_state', f"part-{run}.{file_format}")
+    with BatchedWriter(state_path, STATE_SCHEMA, file_format, batch_rows) as states:
+        for item in scan_items(table):
+            coin_id = item['coin_id']
+            last_updated = item.get('last_updated')
+            if not last_updated:
+                continue
+            version = int(item.get('version', 0))
+            mark = coin_mark(watermarks.get(coin_id))
+            if mark['version'] == version or (mark['since'] is not None and parse_time(last_updated) <= mark['since']):
+                counts['unchanged'] += 1
+                continue
+
+            if mark['since'] is not None:
+                part = 'part-' + mark['since'].astimezone(timezone.utc).strftime('%Y%m%dT%H%M%S%fZ')
+            else:
+                part = 'part-initial' if mark['version'] is None else f"part-v{mark['version']}"
+            state = CoinState(coin_id, item)
+            exported = {}
+            counts['ticks'] += write_partitions(root, 'ticks', coin_id, tick_rows(state, mark),
+                                                TICK_SCHEMA, part, file_format)
+            counts['signals'] += write_partitions(root, 'signals', coin_id,
+                                                  signal_rows(item, events_table, mark, exported),
+                                                  SIGNAL_SCHEMA, part, file_format)
+            counts['profits'] += write_partitions(root, 'profits', coin_id,
+                                                  profit_rows(item, events_table, mark, exported),
+                                                  PROFIT_SCHEMA, part, file_format)
+            states.write(state_row(item))
+            counts['coins'] += 1
+            watermarks[coin_id] = {
+                'version': version,
+                'ticks': [entry['timestamp'] for entry in state.price_history()[-TICK_OVERLAP:]],
+                'counts': exported
+            }
+            print(f"✅ Exported {coin_id} up to version {version}")
+
+    save_watermarks(root, watermarks)
+    return counts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Export trend state and signal history to Parquet/Arrow files")
+    parser.add_argument('--table', default='CryptoTrends_table')
+    parser.add_argument('--events-table', help="read cross/profit histories from the events table")
+    parser.add_argument('--output', default='export')
+    parser.add_argument('--format', choices=('parquet', 'arrow'), default='parquet')
+    parser.add_argument('--full', action='store_true', help="ignore the watermarks of earlier exports")
+    parser.add_argument('--batch-rows', type=int, default=10000, help="rows per trend_state row group")
+    args = parser.parse_args()
+
+    table = DynamoDBTable(args.table)
+    events_table = DynamoDBTable(args.events_table) if args.events_table else None
+    counts = export_table(table, args.output, events_table, args.format, args.full, args.batch_rows)
+    print(f"Done: {counts['coins']} coins, {counts['ticks']} ticks, {counts['signals']} signals, "
+          f"{counts['profits']} profits, {counts['unchanged']} unchanged")
@@ -1,69 +1,216 @@
 import json
+import time
 import urllib3
-import boto3
 import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+from instrumentation import Instrumentation
+from rate_limiter import TokenBucket
+from aws_clients import get_client
 
 # Load environment variables
 KINESIS_STREAM = os.environ.get('KINESIS_STREAM', 'CryptoStream')
+COINGECKO_MARKETS_URL = os.environ.get('COINGECKO_MARKETS_URL', 'https://api.coingecko.com/api/v3/coins/markets')
+MARKETS_PAGES = int(os.environ.get('MARKETS_PAGES', '1'))
+MARKETS_PER_PAGE = int(os.environ.get('MARKETS_PER_PAGE', '250'))  # CoinGecko allows up to 250
+FETCH_CONCURRENCY = int(os.environ.get('FETCH_CONCURRENCY', '4'))
+# 'pages' reads the top MARKETS_PAGES pages of /coins/markets; 'ids' asks for
+# exactly the target coins, IDS_PER_REQUEST of them per request
+FETCH_MODE = os.environ.get('FETCH_MODE', 'pages')
+IDS_PER_REQUEST = min(int(os.environ.get('IDS_PER_REQUEST', '250')), 250)
+# CoinGecko request budget shared by the fetch threads (the public API allows
+# roughly 30 calls a minute)
+COINGECKO_RATE_LIMIT = int(os.environ.get('COINGECKO_RATE_LIMIT', '30'))
+COINGECKO_RATE_PERIOD = float(os.environ.get('COINGECKO_RATE_PERIOD', '60'))
+# Only coins whose last_updated moved since they were last sent are published
+CHANGE_DETECTION = os.environ.get('CHANGE_DETECTION', 'true').lower() == 'true'
+# Text file bundled with the function listing the coin universe, one CoinGecko
+# ID per line (or a JSON list); takes the place of TARGET_COINS
+COIN_UNIVERSE_FILE = os.environ.get('COIN_UNIVERSE_FILE')
 
-# Initialize Kinesis client
-kinesis = boto3.client('kinesis')
+# Kinesis PutRecords limits
+PUT_RECORDS_LIMIT = 500
+PUT_RECORDS_MAX_ATTEMPTS = 3
 
-# Set of allowed CoinGecko IDs
-TARGET_COINS = {'bitcoin', 'ethereum', 'ripple', 'binancecoin', 'solana', 'dogecoin', 'cardano', 'chainlink','polkadot', 'stellar', 'litecoin'}
+# Stage timings and CoinGecko/Kinesis call counts, flushed once per invocation
+metrics = Instrumentation('fetch_prices')
 
-def lambda_handler(event, context):
-    url = "https://api.coingecko.com/api/v3/coins/markets"
-    params = {
+# Kinesis client, created on first use and reused by warm invocations
+def kinesis_client():
+    return get_client('kinesis', lambda client: metrics.instrument_client(client, 'kinesis'))
+
+# Shared across warm invocations so TLS connections to CoinGecko are reused
+http = urllib3.PoolManager(
+    maxsize=FETCH_CONCURRENCY,
+    retries=urllib3.Retry(total=2, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504))
+)
+coingecko_bucket = TokenBucket(COINGECKO_RATE_LIMIT, COINGECKO_RATE_PERIOD)
+
+# What was last sent, kept by warm containers: the ETag of each CoinGecko
+# request and the last_updated of each coin. A cold container starts empty
+# and sends every coin once; the processor drops the repeats.
+etags = {}
+sent_updates = {}
+
+# Set of allowed CoinGecko IDs; TARGET_COINS="id1,id2,..." overrides it and
+# TARGET_COINS="*" keeps every coin on the fetched pages
+DEFAULT_TARGET_COINS = {'bitcoin', 'ethereum', 'ripple', 'binancecoin', 'solana', 'dogecoin', 'cardano', 'chainlink','polkadot', 'stellar', 'litecoin'}
+
+def load_target_coins(value):
+    if not value:
+        return DEFAULT_TARGET_COINS
+    if value.strip() == '*':
+        return None
+    return {coin.strip() for coin in value.split(',') if coin.strip()}
+
+def load_coin_universe(path):
+    with open(path) as f:
+        text = f.read()
+    coins = json.loads(text) if text.lstrip().startswith('[') else text.replace(',', '\n').split()
+    return {coin.strip() for coin in coins if coin.strip()}
+
+TARGET_COINS = (load_coin_universe(COIN_UNIVERSE_FILE) if COIN_UNIVERSE_FILE
+                else load_target_coins(os.environ.get('TARGET_COINS')))
+
+def page_params(page):
+    return {
         'vs_currency': 'usd',
         'order': 'market_cap_desc',
-        'per_page': 50,
-        'page': 1,
+        'per_page': MARKETS_PER_PAGE,
+        'page': page,
         'sparkline': 'false'  # Must be string when using urllib3 fields
     }
 
-    http = urllib3.PoolManager()
+def ids_params(coin_ids):
+    return {
+        'vs_currency': 'usd',
+        'ids': ','.join(coin_ids),
+        'per_page': len(coin_ids),
+        'page': 1,
+        'sparkline': 'false'
+    }
+
+def market_requests(event):
+    # Query parameters of every /coins/markets request this invocation makes.
+    # In 'ids' mode, scheduled rules passing {"worker": i, "workers": n} split
+    # the target coins between n fetchers by a stable hash of the coin ID.
+    if FETCH_MODE != 'ids' or TARGET_COINS is None:
+        return [page_params(page) for page in range(1, MARKETS_PAGES + 1)]
 
-    try:
-        # Send GET request with query parameters
-        encoded_params = urllib3.request.urlencode(params)
-        full_url = f"{url}?{encoded_params}"
+    workers = int(event.get('workers', 1))
+    worker = int(event.get('worker', 0))
+    coin_ids = sorted(coin for coin in TARGET_COINS if zlib.crc32(coin.encode('utf-8')) % workers == worker)
+    return [ids_params(coin_ids[i:i + IDS_PER_REQUEST]) for i in range(0, len(coin_ids), IDS_PER_REQUEST)]
 
-        response = http.request('GET', full_url)
-        
-        if response.status != 200:
-            raise Exception(f"Request failed with status {response.status}")
+def fetch_markets_request(params):
+    # One GET, paced by the CoinGecko bucket. Returns (url, etag, coins), with
+    # coins None when CoinGecko answers 304 to the ETag it sent last time.
+    url = f"{COINGECKO_MARKETS_URL}?{urlencode(params)}"
+    headers = {'If-None-Match': etags[url]} if CHANGE_DETECTION and url in etags else {}
+    coingecko_bucket.acquire()
+    response = http.request('GET', url, headers=headers)
+    metrics.count('coingecko_calls')
+    metrics.count('coingecko_bytes_received', len(response.data), 'Bytes')
 
-        coins = json.loads(response.data.decode('utf-8'))
+    if response.status == 304:
+        metrics.count('coingecko_not_modified')
+        return url, etags[url], None
+    if response.status != 200:
+        raise Exception(f"Request for {url} failed with status {response.status}")
 
-        count = 0
-        for coin in coins:
-            if coin['id'] not in TARGET_COINS:
-                continue  # Skip coins not in our target list
+    return url, response.headers.get('ETag'), json.loads(response.data.decode('utf-8'))
 
-            record = {
-                'id': coin['id'],
-                'symbol': coin['symbol'],
-                'price': coin['current_price'],
-                'market_cap': coin['market_cap'],
-                'timestamp': coin['last_updated']
-            }
+def fetch_markets(requests):
+    # Requests run concurrently over the shared pool. A failed request is
+    # logged and returned as None so the others are still published.
+    def fetch(params):
+        try:
+            return fetch_markets_request(params)
+        except Exception as e:
+            print(f"❌ CoinGecko request failed: {e}")
+            metrics.count('coingecko_failures')
+            return None
 
-            kinesis.put_record(
-                StreamName=KINESIS_STREAM,
-                Data=json.dumps(record),
-                PartitionKey=coin['id']
-            )
+    with ThreadPoolExecutor(max_workers=max(1, min(FETCH_CONCURRENCY, len(requests)))) as executor:
+        return list(executor.map(fetch, requests))
 
-            count += 1
+def build_record(coin):
+    return {
+        'id': coin['id'],
+        'symbol': coin['symbol'],
+        'price': coin['current_price'],
+        'market_cap': coin['market_cap'],
+        'volume': coin.get('total_volume'),
+        'timestamp': coin['last_updated']
+    }
 
-        return {
-            'statusCode': 200,
-            'body': f"{count} selected coin records sent to Kinesis stream '{KINESIS_STREAM}'"
-        }
+def put_records(records):
+    # Sends records in PutRecords batches of up to 500 and retries only the
+    # entries Kinesis rejected. Returns (sent, IDs of the coins not sent).
+    entries = [{'Data': json.dumps(record), 'PartitionKey': record['id']} for record in records]
+    sent = 0
+    failed = []
+    for i in range(0, len(entries), PUT_RECORDS_LIMIT):
+        pending = entries[i:i + PUT_RECORDS_LIMIT]
+        for attempt in range(PUT_RECORDS_MAX_ATTEMPTS):
+            response = kinesis_client().put_records(StreamName=KINESIS_STREAM, Records=pending)
+            retry = [entry for entry, result in zip(pending, response['Records']) if 'ErrorCode' in result]
+            sent += len(pending) - len(retry)
+            pending = retry
+            if not pending:
+                break
+            print(f"⚠️ {len(pending)} records rejected by Kinesis, retrying ({attempt + 1}/{PUT_RECORDS_MAX_ATTEMPTS})")
+            time.sleep(0.1 * 2 ** attempt)
+        failed.extend(entry['PartitionKey'] for entry in pending)
+    return sent, failed
 
-    except requests.exceptions.RequestException as e:
+@metrics.invocation
+def lambda_handler(event, context):
+    with metrics.timer('fetch'):
+        results = fetch_markets(market_requests(event or {}))
+    if results and all(result is None for result in results):
         return {
             'statusCode': 500,
-            'body': f"Request failed: {str(e)}"
+            'body': "Request failed: every CoinGecko request failed"
         }
+
+    records = {}
+    unchanged = 0
+    for result in results:
+        if result is None or result[2] is None:
+            continue
+        for coin in result[2]:
+            if TARGET_COINS is not None and coin['id'] not in TARGET_COINS:
+                continue  # Skip coins not in our target list
+            if CHANGE_DETECTION and coin['last_updated'] and sent_updates.get(coin['id']) == coin['last_updated']:
+                unchanged += 1
+                continue
+            # A coin can show up on two pages if the ranking shifts between requests
+            records[coin['id']] = build_record(coin)
+    metrics.count('coins_unchanged', unchanged)
+
+    with metrics.timer('put_records'):
+        sent, failed = put_records(list(records.values()))
+    metrics.count('records_sent', sent)
+    metrics.count('records_failed', len(failed))
+    if failed:
+        print(f"❌ {len(failed)} records could not be sent to Kinesis")
+
+    # Remember what reached Kinesis; a request's ETag only counts once all of
+    # its coins did
+    failed = set(failed)
+    for coin_id, record in records.items():
+        if coin_id not in failed:
+            sent_updates[coin_id] = record['timestamp']
+    if not failed:
+        for result in results:
+            if result is not None and result[1]:
+                etags[result[0]] = result[1]
+
+    return {
+        'statusCode': 200 if not failed else 207,
+        'body': f"{sent} selected coin records sent to Kinesis stream '{KINESIS_STREAM}'"
+                + (f", {unchanged} unchanged" if unchanged else "")
+                + (f", {len(failed)} failed" if failed else "")
+    }
@@ -0,0 +1,499 @@
+import math
+from collections import deque
+from decimal import Decimal
+
+EMA_SHORT = 50
+EMA_LONG = 200
+SMA_SHORT = 50
+SMA_LONG = 200
+RSI_PERIOD = 14
+MACD_FAST = 12
+MACD_SLOW = 26
+MACD_SIGNAL = 9
+BOLLINGER_PERIOD = 20
+BOLLINGER_WIDTH = 2
+
+# Number types the engine can run on. 'decimal' is exact; 'float' uses binary
+# floats for the arithmetic and only converts to Decimal at the DynamoDB
+# boundary (to_decimal). Both accept Decimal or numeric strings as input.
+NUMERIC_BACKENDS = {
+    'decimal': Decimal,
+    'float': float,
+}
+
+
+def to_decimal(value):
+    if isinstance(value, float):
+        return Decimal(repr(value))
+    if isinstance(value, dict):
+        return {key: to_decimal(item) for key, item in value.items()}
+    return value
+
+
+def square_root(value):
+    return value.sqrt() if isinstance(value, Decimal) else math.sqrt(value)
+
+
+def detect_signal(short_ma, long_ma, prev_short, prev_long):
+    if prev_short < prev_long and short_ma > long_ma:
+        return "Golden Cross"
+    elif prev_short > prev_long and short_ma < long_ma:
+        return "Dead Cross"
+    return None
+
+
+def confirm_signal(short_ma, long_ma, price, filter_state, epoch, min_spread_bps=0, confirm_ticks=1, cooldown=0):
+    # detect_signal with hysteresis. filter_state is (side, pending, last):
+    # the confirmed side of short vs long (+1/-1, 0 if unknown), how many
+    # consecutive ticks have been on the other side by at least min_spread_bps
+    # of the price, and the epoch second of the last signal. A cross held back
+    # by the cooldown still fires once it ends, if it holds until then.
+    # Returns the signal (or None) and the new filter state.
+    side, pending, last = filter_state
+    spread_bps = (short_ma - long_ma) / price * 10000 if price else 0
+    if spread_bps == 0 or abs(spread_bps) < min_spread_bps:
+        return None, (side, 0, last)
+    current = 1 if spread_bps > 0 else -1
+    if side == 0:
+        return None, (current, 0, last)
+    if current == side:
+        return None, (side, 0, last)
+    pending += 1
+    if pending < confirm_ticks or (last is not None and epoch - last < cooldown):
+        return None, (side, pending, last)
+    return ("Golden Cross" if current > 0 else "Dead Cross"), (current, 0, epoch)
+
+
+# Indicator types by name. Each class keeps its own streaming state:
+# update(price, volume, timestamp) advances it by one tick, outputs() returns
+# its current values ('' is the main value, other keys are suffixed to the
+# indicator's name), snapshot()/restore() round-trip the state through
+# `indicator_state`, and `lookback` is how many trailing prices restore() needs.
+# insert() takes a late tick that has already been placed in `prices` (the
+# whole stored history) and recomputes only what that tick changes.
+INDICATOR_TYPES = {}
+
+
+def register_indicator(kind):
+    def register(cls):
+        INDICATOR_TYPES[kind] = cls
+        return cls
+    return register
+
+
+@register_indicator('ema')
+class WindowedEMA:
+    # Same result as calculate_ema(prices[-period:], period): the plain mean
+    # while the window fills, then an EMA seeded from the oldest price in the
+    # window. Sliding the window by one price only needs the two oldest prices.
+    def __init__(self, period, number=Decimal):
+        self.period = self.lookback = period
+        self.number = number
+        self.window = deque(maxlen=period)
+        self.total = number(0)
+        self.value = None
+        self.multiplier = number(2) / (number(period) + number(1))
+        self.decay = number(1) - self.multiplier
+        self.decay_n = self.decay ** period
+
+    def update(self, price, volume=None, timestamp=None):
+        window = self.window
+        if len(window) == self.period:
+            oldest, next_oldest = window[0], window[1]
+            window.append(price)
+            self.value = (self.decay * self.value + self.multiplier * price
+                          + self.decay_n * (next_oldest - oldest))
+            return self.value
+
+        window.append(price)
+        if len(window) < self.period:
+            self.total += price
+            self.value = self.total / len(window)
+        else:
+            # Window just filled: seed once, then slide in O(1) from here on
+            ema = window[0]
+            for p in list(window)[1:]:
+                ema = (p - ema) * self.multiplier + ema
+            self.value = ema
+        return self.value
+
+    def outputs(self):
+        return {'': self.value}
+
+    def snapshot(self):
+        return self.value
+
+    def restore(self, value, prices):
+        self.window = deque(prices[-self.period:], maxlen=self.period)
+        if len(self.window) < self.period:
+            self.total = sum(self.window, self.number(0))
+        self.value = self.number(value)
+
+    def insert(self, prices, price, volume=None, timestamp=None):
+        # Only the last `period` prices count
+        self.__init__(self.period, self.number)
+        for p in prices[-self.period:]:
+            self.update(p)
+
+
+@register_indicator('sma')
+class RollingSMA:
+    # Same result as calculate_sma(prices, period), kept as a running sum.
+    # With floats the sum is re-added exactly once per window to stop rounding
+    # drift from building up.
+    def __init__(self, period, number=Decimal):
+        self.period = self.lookback = period
+        self.number = number
+        self.window = deque(maxlen=period)
+        self.total = number(0)
+        self.value = None
+        self.updates = 0
+
+    def update(self, price, volume=None, timestamp=None):
+        if len(self.window) == self.period:
+            self.total -= self.window[0]
+        self.window.append(price)
+        self.total += price
+        self.updates += 1
+        if self.number is float and self.updates % self.period == 0:
+            self.total = math.fsum(self.window)
+        self.value = self.total / len(self.window)
+        return self.value
+
+    def outputs(self):
+        return {'': self.value}
+
+    def snapshot(self):
+        return self.total
+
+    def restore(self, total, prices):
+        self.window = deque(prices[-self.period:], maxlen=self.period)
+        self.total = math.fsum(self.window) if self.number is float else self.number(total)
+        self.value = self.total / len(self.window) if self.window else None
+
+    def insert(self, prices, price, volume=None, timestamp=None):
+        self.__init__(self.period, self.number)
+        for p in prices[-self.period:]:
+            self.update(p)
+
+
+@register_indicator('rsi')
+class RSI:
+    # Wilder's RSI: plain average gain/loss over the first `period` price
+    # changes, then smoothed by (period - 1) / period on every tick
+    def __init__(self, period, number=Decimal):
+        self.period = period
+        self.number = number
+        self.lookback = 1
+        self.last = None
+        self.count = 0
+        self.avg_gain = number(0)
+        self.avg_loss = number(0)
+        self.value = None
+
+    def update(self, price, volume=None, timestamp=None):
+        if self.last is not None:
+            change = price - self.last
+            gain = change if change > 0 else self.number(0)
+            loss = -change if change < 0 else self.number(0)
+            self.count += 1
+            if self.count <= self.period:
+                self.avg_gain += (gain - self.avg_gain) / self.count
+                self.avg_loss += (loss - self.avg_loss) / self.count
+            else:
+                self.avg_gain = (self.avg_gain * (self.period - 1) + gain) / self.period
+                self.avg_loss = (self.avg_loss * (self.period - 1) + loss) / self.period
+            self._calculate()
+        self.last = price
+        return self.value
+
+    def _calculate(self):
+        if self.count < self.period:
+            return
+        if not self.avg_loss:
+            self.value = self.number(100) if self.avg_gain else self.number(50)
+        else:
+            self.value = 100 - 100 / (1 + self.avg_gain / self.avg_loss)
+
+    def outputs(self):
+        return {'': self.value}
+
+    def snapshot(self):
+        return {'avg_gain': self.avg_gain, 'avg_loss': self.avg_loss, 'count': self.count}
+
+    def restore(self, snapshot, prices):
+        self.last = prices[-1] if prices else None
+        self.count = int(snapshot['count'])
+        self.avg_gain = self.number(snapshot['avg_gain'])
+        self.avg_loss = self.number(snapshot['avg_loss'])
+        self._calculate()
+
+    def insert(self, prices, price, volume=None, timestamp=None):
+        # Path-dependent: replayed over the stored history, as when a newly
+        # configured indicator warms up
+        self.__init__(self.period, self.number)
+        for p in prices:
+            self.update(p)
+
+
+@register_indicator('macd')
+class MACD:
+    # Fast EMA minus slow EMA, with a signal EMA of that difference. These are
+    # the usual unwindowed EMAs, seeded with the first value they see.
+    def __init__(self, fast, slow, signal, number=Decimal):
+        self.number = number
+        self.lookback = 0
+        self.periods = (fast, slow, signal)
+        self.multipliers = tuple(number(2) / (number(period) + number(1)) for period in (fast, slow, signal))
+        self.fast = self.slow = self.signal = None
+
+    def update(self, price, volume=None, timestamp=None):
+        fast_k, slow_k, signal_k = self.multipliers
+        if self.fast is None:
+            self.fast = self.slow = price
+        else:
+            self.fast += (price - self.fast) * fast_k
+            self.slow += (price - self.slow) * slow_k
+        macd = self.fast - self.slow
+        self.signal = macd if self.signal is None else self.signal + (macd - self.signal) * signal_k
+        return macd
+
+    def outputs(self):
+        if self.fast is None:
+            return {'': None, 'signal': None, 'histogram': None}
+        macd = self.fast - self.slow
+        return {'': macd, 'signal': self.signal, 'histogram': macd - self.signal}
+
+    def snapshot(self):
+        return {'fast': self.fast, 'slow': self.slow, 'signal': self.signal}
+
+    def restore(self, snapshot, prices):
+        self.fast, self.slow, self.signal = (
+            self.number(snapshot[name]) for name in ('fast', 'slow', 'signal'))
+
+    def insert(self, prices, price, volume=None, timestamp=None):
+        # Path-dependent, replayed like RSI
+        self.__init__(*self.periods, number=self.number)
+        for p in prices:
+            self.update(p)
+
+
+@register_indicator('bollinger')
+class BollingerBands:
+    # Mean of the last `period` prices plus/minus `width` population standard
+    # deviations, from running sums of prices and squared prices. With floats
+    # the sums are re-added exactly once per window, as in RollingSMA.
+    def __init__(self, period, width, number=Decimal):
+        self.period = self.lookback = period
+        self.width = number(width)
+        self.number = number
+        self.window = deque(maxlen=period)
+        self.total = number(0)
+        self.total_sq = number(0)
+        self.updates = 0
+        self.middle = self.upper = self.lower = None
+
+    def update(self, price, volume=None, timestamp=None):
+        if len(self.window) == self.period:
+            oldest = self.window[0]
+            self.total -= oldest
+            self.total_sq -= oldest * oldest
+        self.window.append(price)
+        self.total += price
+        self.total_sq += price * price
+        self.updates += 1
+        if self.number is float and self.updates % self.period == 0:
+            self._resum()
+        self._calculate()
+        return self.middle
+
+    def _resum(self):
+        self.total = math.fsum(self.window)
+        self.total_sq = math.fsum(price * price for price in self.window)
+
+    def _calculate(self):
+        count = len(self.window)
+        if not count:
+            return
+        self.middle = self.total / count
+        variance = max(self.total_sq / count - self.middle * self.middle, self.number(0))
+        deviation = square_root(variance) * self.width
+        self.upper = self.middle + deviation
+        self.lower = self.middle - deviation
+
+    def outputs(self):
+        return {'middle': self.middle, 'upper': self.upper, 'lower': self.lower}
+
+    def snapshot(self):
+        return {'total': self.total, 'total_sq': self.total_sq}
+
+    def restore(self, snapshot, prices):
+        self.window = deque(prices[-self.period:], maxlen=self.period)
+        if self.number is float:
+            self._resum()
+        else:
+            self.total = self.number(snapshot['total'])
+            self.total_sq = self.number(snapshot['total_sq'])
+        self._calculate()
+
+    def insert(self, prices, price, volume=None, timestamp=None):
+        self.__init__(self.period, self.width, self.number)
+        for p in prices[-self.period:]:
+            self.update(p)
+
+
+@register_indicator('vwap')
+class SessionVWAP:
+    # Volume-weighted average price since the start of the tick's day, in the
+    # timestamp's own timezone. `volume` is the rolling 24h volume CoinGecko
+    # reports, so each tick is weighted by how much it grew since the previous
+    # tick: the volume traded in between. A falling 24h volume (more volume
+    # left the window than was traded) gives the tick no weight. Ticks without
+    # a volume leave it unchanged.
+    def __init__(self, number=Decimal):
+        self.number = number
+        self.lookback = 0
+        self.session = None
+        self.price_volume = number(0)
+        self.volume = number(0)
+        self.last_volume = None
+        self.value = None
+
+    def update(self, price, volume=None, timestamp=None):
+        if volume is None or timestamp is None:
+            return self.value
+        session = str(timestamp)[:10]
+        if session != self.session:
+            self.session = session
+            self.price_volume = self.number(0)
+            self.volume = self.number(0)
+        traded = volume - self.last_volume if self.last_volume is not None else 0
+        self.last_volume = volume
+        if traded > 0:
+            self.price_volume += price * traded
+            self.volume += traded
+        if self.volume:
+            self.value = self.price_volume / self.volume
+        return self.value
+
+    def outputs(self):
+        return {'': self.value}
+
+    def snapshot(self):
+        return {'session': self.session, 'price_volume': self.price_volume, 'volume': self.volume,
+                'last_volume': self.last_volume}
+
+    def restore(self, snapshot, prices):
+        self.session = snapshot['session']
+        self.price_volume = self.number(snapshot['price_volume'])
+        self.volume = self.number(snapshot['volume'])
+        self.last_volume = self.number(snapshot['last_volume']) if snapshot.get('last_volume') is not None else None
+        self.value = self.price_volume / self.volume if self.volume else None
+
+    def insert(self, prices, price, volume=None, timestamp=None):
+        # The newer tick's growth already covers the volume traded around a
+        # late tick, so it is not counted again
+        return self.value
+
+
+# Indicators that can be configured: name -> (type, parameters). The name keys
+# the indicator's state in `indicator_state` and its values on the trend item.
+INDICATORS = {
+    'ema_short': ('ema', {'period': EMA_SHORT}),
+    'ema_long': ('ema', {'period': EMA_LONG}),
+    'sma_short': ('sma', {'period': SMA_SHORT}),
+    'sma_long': ('sma', {'period': SMA_LONG}),
+    'rsi': ('rsi', {'period': RSI_PERIOD}),
+    'macd': ('macd', {'fast': MACD_FAST, 'slow': MACD_SLOW, 'signal': MACD_SIGNAL}),
+    'bollinger': ('bollinger', {'period': BOLLINGER_PERIOD, 'width': BOLLINGER_WIDTH}),
+    'vwap': ('vwap', {}),
+}
+DEFAULT_INDICATORS = ('ema_short', 'ema_long', 'sma_short', 'sma_long')
+
+# Crossover signals tracked per coin: prefix -> the indicators it needs and
+# the two values it compares. A Golden Cross is `fast` crossing above `slow`.
+SIGNAL_RULES = {
+    'ema': {'indicators': ('ema_short', 'ema_long'), 'fast': 'ema_short', 'slow': 'ema_long'},
+    'sma': {'indicators': ('sma_short', 'sma_long'), 'fast': 'sma_short', 'slow': 'sma_long'},
+    'macd': {'indicators': ('macd',), 'fast': 'macd', 'slow': 'macd_signal'},
+}
+DEFAULT_SIGNALS = ('ema', 'sma')
+
+
+def indicator_names(names, signals):
+    # The configured indicators plus any the signals compare, without repeats
+    wanted = list(names)
+    for prefix in signals:
+        wanted.extend(SIGNAL_RULES[prefix]['indicators'])
+    return tuple(dict.fromkeys(wanted))
+
+
+class IndicatorEngine:
+    # Running state of the configured indicators for one coin, updated in one
+    # pass per price. The state round-trips through the item's
+    # `indicator_state` attribute and is only rebuilt from `price_history`
+    # when it is missing or stale.
+    def __init__(self, number=Decimal, names=DEFAULT_INDICATORS):
+        self.number = number
+        self.indicators = {}
+        for name in names:
+            kind, params = INDICATORS[name]
+            self.indicators[name] = INDICATOR_TYPES[kind](number=number, **params)
+        self.timestamp = None
+
+    def update(self, price, timestamp, volume=None):
+        price = self.number(price)
+        if volume is not None:
+            volume = self.number(volume)
+        for indicator in self.indicators.values():
+            indicator.update(price, volume, timestamp)
+        self.timestamp = timestamp
+        return self.values()
+
+    def insert(self, history, price, timestamp, volume=None):
+        # A late tick already placed in `history`, behind the newest tick
+        prices = [self.number(entry['price']) for entry in history]
+        price = self.number(price)
+        if volume is not None:
+            volume = self.number(volume)
+        for indicator in self.indicators.values():
+            indicator.insert(prices, price, volume, timestamp)
+        return self.values()
+
+    def values(self):
+        values = {}
+        for name, indicator in self.indicators.items():
+            for suffix, value in indicator.outputs().items():
+                values[f'{name}_{suffix}' if suffix else name] = value
+        return values
+
+    def to_state(self):
+        state = {name: to_decimal(ind.snapshot()) for name, ind in self.indicators.items()}
+        state['timestamp'] = self.timestamp
+        return state
+
+    @classmethod
+    def from_history(cls, history, number=Decimal, names=DEFAULT_INDICATORS):
+        engine = cls(number, names)
+        for entry in history:
+            engine.update(entry['price'], entry['timestamp'])
+        return engine
+
+    @classmethod
+    def restore(cls, state, history, number=Decimal, names=DEFAULT_INDICATORS):
+        # Saved state is only trusted if it was taken at the last stored tick
+        if not state or not history or state.get('timestamp') != history[-1]['timestamp']:
+            return cls.from_history(history, number, names)
+
+        engine = cls(number, names)
+        lookback = max([1] + [indicator.lookback for indicator in engine.indicators.values()])
+        prices = [number(entry['price']) for entry in history[-lookback:]]
+        for name, indicator in engine.indicators.items():
+            if state.get(name) is None:
+                # Newly configured indicator: warm it up from the stored history
+                for entry in history:
+                    indicator.update(number(entry['price']), None, entry['timestamp'])
+            else:
+                indicator.restore(state[name], prices)
+        engine.timestamp = state['timestamp']
+        return engine
@@ -0,0 +1,110 @@
+import functools
+import json
+import os
+import random
+import threading
+import time
+from contextlib import nullcontext
+
+# Per-invocation stage timings and counters, written once at the end of the
+# invocation as a CloudWatch Embedded Metric Format log line. CloudWatch turns
+# that line into metrics, so nothing is called remotely.
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'CryptoMood')
+# Fraction of invocations that are measured; the others skip all bookkeeping
+METRICS_SAMPLE_RATE = float(os.environ.get('METRICS_SAMPLE_RATE', '1'))
+
+NO_TIMER = nullcontext()
+
+
+class StageTimer:
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.add(f'{self.stage}_ms', (time.perf_counter() - self.started) * 1000, 'Milliseconds')
+
+
+class Instrumentation:
+    # metrics.timer('store') times a stage (summed if it runs several times),
+    # metrics.count('alerts') counts, and instrument_client() counts the calls
+    # and bytes of a boto3 client through its event hooks. Threads may record
+    # concurrently.
+    def __init__(self, service, namespace=METRICS_NAMESPACE, sample_rate=METRICS_SAMPLE_RATE):
+        self.service = service
+        self.namespace = namespace
+        self.sample_rate = sample_rate
+        self.lock = threading.Lock()
+        self.enabled = False
+        self.values = {}
+        self.units = {}
+
+    def start(self):
+        self.enabled = self.sample_rate > 0 and random.random() < self.sample_rate
+        self.values = {}
+
+    def timer(self, stage):
+        return StageTimer(self, stage) if self.enabled else NO_TIMER
+
+    def add(self, name, value, unit='Count'):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.values[name] = self.values.get(name, 0) + value
+            self.units[name] = unit
+
+    def count(self, name, value=1, unit='Count'):
+        self.add(name, value, unit)
+
+    def instrument_client(self, client, prefix):
+        def before_send(request, **kwargs):
+            if self.enabled:
+                self.add(f'{prefix}_bytes_sent', len(request.body or b''), 'Bytes')
+
+        def after_call(http_response, **kwargs):
+            if self.enabled:
+                self.add(f'{prefix}_calls', 1)
+                self.add(f'{prefix}_bytes_received', len(http_response.content or b''), 'Bytes')
+
+        client.meta.events.register('before-send', before_send)
+        client.meta.events.register('after-call', after_call)
+        return client
+
+    def document(self):
+        names = sorted(self.values)
+        document = {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': self.namespace,
+                    'Dimensions': [['Service']],
+                    'Metrics': [{'Name': name, 'Unit': self.units[name]} for name in names]
+                }]
+            },
+            'Service': self.service,
+            'SampleRate': self.sample_rate
+        }
+        document.update({name: round(self.values[name], 3) for name in names})
+        return document
+
+    def flush(self):
+        if self.enabled and self.values:
+            print(json.dumps(self.document()))
+        self.enabled = False
+        self.values = {}
+
+    def invocation(self, handler):
+        # Wraps a lambda_handler: sample, run, then flush exactly once
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            self.start()
+            try:
+                with self.timer('invocation'):
+                    return handler(event, context)
+            finally:
+                self.flush()
+        return wrapper
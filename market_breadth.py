@@ -0,0 +1,78 @@
+from datetime import datetime
+
+import numpy as np
+
+# Cross-coin view for the stream processor: the latest price, long SMA,
+# market cap and trend direction of every coin this container has processed,
+# one row per coin in parallel NumPy arrays, plus a ring of recent crosses.
+# Breadth metrics are a few vectorized reductions over them. With one Kinesis
+# shard a warm container sees the whole market; with more, each container
+# sees the coins of its own shards.
+
+
+def epoch_seconds(timestamp):
+    return datetime.fromisoformat(timestamp).timestamp()
+
+
+class MarketSnapshot:
+    def __init__(self, capacity=256, cross_capacity=4096):
+        capacity = max(capacity, 1)
+        self.rows = {}
+        self.prices = np.full(capacity, np.nan)
+        self.long_mas = np.full(capacity, np.nan)
+        self.market_caps = np.zeros(capacity)
+        # +1 fast MA above slow, -1 below, 0 unknown
+        self.trends = np.zeros(capacity, dtype=np.int8)
+        self.cross_times = np.full(cross_capacity, -np.inf)
+        self.cross_signs = np.zeros(cross_capacity, dtype=np.int8)
+        self.next_cross = 0
+
+    def _row(self, coin_id):
+        row = self.rows.get(coin_id)
+        if row is None:
+            row = self.rows[coin_id] = len(self.rows)
+            if row == len(self.prices):
+                grow = max(len(self.prices), 1)
+                self.prices = np.concatenate([self.prices, np.full(grow, np.nan)])
+                self.long_mas = np.concatenate([self.long_mas, np.full(grow, np.nan)])
+                self.market_caps = np.concatenate([self.market_caps, np.zeros(grow)])
+                self.trends = np.concatenate([self.trends, np.zeros(grow, dtype=np.int8)])
+        return row
+
+    def update(self, coin_id, price, long_ma, trend):
+        row = self._row(coin_id)
+        self.prices[row] = float(price)
+        self.long_mas[row] = np.nan if long_ma is None else float(long_ma)
+        self.trends[row] = trend
+
+    def set_market_cap(self, coin_id, market_cap):
+        # _row may grow the arrays, so look the row up before indexing
+        row = self._row(coin_id)
+        self.market_caps[row] = float(market_cap)
+
+    def add_cross(self, signal, timestamp):
+        slot = self.next_cross % len(self.cross_times)
+        self.cross_times[slot] = epoch_seconds(timestamp)
+        self.cross_signs[slot] = 1 if signal == 'Golden Cross' else -1
+        self.next_cross += 1
+
+    def summary(self, timestamp, window, pending=()):
+        # Breadth as of `timestamp`, counting crosses in the last `window`
+        # seconds. `pending` are (signal, timestamp) crosses counted as if
+        # added, without adding them.
+        count = len(self.rows)
+        prices, long_mas = self.prices[:count], self.long_mas[:count]
+        caps, trends = self.market_caps[:count], self.trends[:count]
+
+        known = ~np.isnan(prices) & ~np.isnan(long_mas)
+        since = epoch_seconds(timestamp) - window
+        recent = self.cross_times >= since
+        pending = [signal for signal, moment in pending if epoch_seconds(moment) >= since]
+        weighted = caps * (trends != 0)
+        return {
+            'coins': count,
+            'pct_above_sma_long': float(np.mean(prices[known] > long_mas[known]) * 100) if known.any() else None,
+            'golden_crosses': int(np.count_nonzero(recent & (self.cross_signs > 0))) + pending.count('Golden Cross'),
+            'dead_crosses': int(np.count_nonzero(recent & (self.cross_signs < 0))) + pending.count('Dead Cross'),
+            'cap_weighted_trend': float(np.dot(weighted, trends) / weighted.sum()) if weighted.sum() else None
+        }
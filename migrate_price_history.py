@@ -0,0 +1,46 @@
+import argparse
+from aws_clients import DynamoDBTable
+from coin_state import CoinState, VersionConflict
+
+# One-off conversion of every coin item between the `price_history` list
+# format and the packed Binary format. Items are also migrated lazily by the
+# stream processor on their next write, so this only speeds that up.
+
+
+def migrate_table(table, history_format='packed', price_format='fixed', compress=False):
+    migrated = skipped = 0
+    scan_kwargs = {}
+    while True:
+        response = table.scan(**scan_kwargs)
+        for item in response.get('Items', []):
+            source = 'price_history' if history_format == 'packed' else 'price_history_packed'
+            if source not in item:
+                continue
+
+            state = CoinState(item['coin_id'], item)
+            state.stage_price_history(history_format, price_format, compress)
+            try:
+                state.save(table)
+                migrated += 1
+                print(f"✅ Migrated {state.coin_id} to {history_format} price history")
+            except VersionConflict:
+                skipped += 1
+                print(f"🔁 {state.coin_id} changed during migration, leaving it to the processor")
+
+        if 'LastEvaluatedKey' not in response:
+            break
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    return migrated, skipped
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Convert stored price histories between formats")
+    parser.add_argument('--table', default='CryptoTrends_table')
+    parser.add_argument('--format', choices=('packed', 'list'), default='packed')
+    parser.add_argument('--prices', choices=('fixed', 'float64'), default='fixed')
+    parser.add_argument('--compress', action='store_true')
+    args = parser.parse_args()
+
+    table = DynamoDBTable(args.table)
+    migrated, skipped = migrate_table(table, args.format, args.prices, args.compress)
+    print(f"Done: {migrated} migrated, {skipped} skipped")
@@ -0,0 +1,199 @@
+import struct
+import zlib
+from decimal import Decimal
+from datetime import datetime, timezone, timedelta
+
+# Packed price history layout (all integers are varints, signed ones zigzag):
+#   b'PH' | version | flags | payload (zlib-compressed when FLAG_ZLIB is set)
+#   payload: count | price scale | UTC offset in minutes
+#            | first epoch-microsecond timestamp | timestamp deltas
+#            | prices: fixed-point first value + deltas, or raw float64 values
+#
+# Packed candles use the same header with b'CD' and, after the timestamps of
+# the candle starts, the open, high, low and close columns as fixed-point
+# first value + deltas.
+MAGIC = b'PH'
+CANDLE_MAGIC = b'CD'
+VERSION = 1
+FLAG_ZLIB = 0x01
+FLAG_FLOAT64 = 0x02
+
+PRICE_FORMATS = ('fixed', 'float64')
+CANDLE_COLUMNS = ('open', 'high', 'low', 'close')
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+ONE_MICROSECOND = timedelta(microseconds=1)
+
+
+def _write_varint(out, value):
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _write_signed(out, value):
+    _write_varint(out, value << 1 if value >= 0 else ((-value) << 1) - 1)
+
+
+def _read_varint(data, pos):
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _read_signed(data, pos):
+    value, pos = _read_varint(data, pos)
+    return (value >> 1) ^ -(value & 1), pos
+
+
+def _price_scale(prices):
+    scale = 0
+    for price in prices:
+        exponent = price.as_tuple().exponent
+        if exponent < 0:
+            scale = max(scale, -exponent)
+    return scale
+
+
+def encode_price_history(history, price_format='fixed', compress=False):
+    if price_format not in PRICE_FORMATS:
+        raise ValueError(f"Unknown price format: {price_format}")
+
+    times = [datetime.fromisoformat(entry['timestamp']) for entry in history]
+    offset = times[0].utcoffset() if times else timedelta(0)
+    if any(t.utcoffset() != offset for t in times):
+        raise ValueError("Packed price history needs one UTC offset for all timestamps")
+
+    prices = [Decimal(entry['price']) for entry in history]
+    scale = _price_scale(prices) if price_format == 'fixed' else 0
+
+    out = bytearray()
+    _write_varint(out, len(history))
+    _write_varint(out, scale)
+    _write_signed(out, int(offset.total_seconds()) // 60)
+
+    previous = 0
+    for t in times:
+        micros = (t - EPOCH) // ONE_MICROSECOND
+        _write_signed(out, micros - previous)
+        previous = micros
+
+    if price_format == 'fixed':
+        previous = 0
+        for price in prices:
+            scaled = int(price.scaleb(scale))
+            _write_signed(out, scaled - previous)
+            previous = scaled
+    else:
+        out += struct.pack(f'<{len(prices)}d', *map(float, prices))
+
+    flags = FLAG_FLOAT64 if price_format == 'float64' else 0
+    payload = bytes(out)
+    if compress:
+        flags |= FLAG_ZLIB
+        payload = zlib.compress(payload)
+    return MAGIC + bytes([VERSION, flags]) + payload
+
+
+def decode_price_history(data):
+    # Accepts raw bytes or the boto3 Binary wrapper returned by DynamoDB
+    data = bytes(getattr(data, 'value', data))
+    if data[:2] != MAGIC or data[2] != VERSION:
+        raise ValueError("Not a packed price history")
+
+    flags = data[3]
+    payload = zlib.decompress(data[4:]) if flags & FLAG_ZLIB else data[4:]
+
+    count, pos = _read_varint(payload, 0)
+    scale, pos = _read_varint(payload, pos)
+    offset_minutes, pos = _read_signed(payload, pos)
+    tz = timezone(timedelta(minutes=offset_minutes))
+
+    timestamps = []
+    micros = 0
+    for _ in range(count):
+        delta, pos = _read_signed(payload, pos)
+        micros += delta
+        timestamps.append((EPOCH + micros * ONE_MICROSECOND).astimezone(tz).isoformat())
+
+    prices = []
+    if flags & FLAG_FLOAT64:
+        prices = [Decimal(repr(p)) for p in struct.unpack_from(f'<{count}d', payload, pos)]
+    else:
+        scaled = 0
+        for _ in range(count):
+            delta, pos = _read_signed(payload, pos)
+            scaled += delta
+            prices.append(Decimal(scaled).scaleb(-scale))
+
+    return [{'price': price, 'timestamp': timestamp} for price, timestamp in zip(prices, timestamps)]
+
+
+def encode_candles(candles, compress=False):
+    times = [datetime.fromisoformat(candle['start']) for candle in candles]
+    offset = times[0].utcoffset() if times else timedelta(0)
+    if any(t.utcoffset() != offset for t in times):
+        raise ValueError("Packed candles need one UTC offset for all timestamps")
+
+    columns = [[Decimal(candle[name]) for candle in candles] for name in CANDLE_COLUMNS]
+    scale = max((_price_scale(column) for column in columns), default=0)
+
+    out = bytearray()
+    _write_varint(out, len(candles))
+    _write_varint(out, scale)
+    _write_signed(out, int(offset.total_seconds()) // 60)
+
+    previous = 0
+    for t in times:
+        micros = (t - EPOCH) // ONE_MICROSECOND
+        _write_signed(out, micros - previous)
+        previous = micros
+
+    for column in columns:
+        previous = 0
+        for price in column:
+            scaled = int(price.scaleb(scale))
+            _write_signed(out, scaled - previous)
+            previous = scaled
+
+    flags = 0
+    payload = bytes(out)
+    if compress:
+        flags |= FLAG_ZLIB
+        payload = zlib.compress(payload)
+    return CANDLE_MAGIC + bytes([VERSION, flags]) + payload
+
+
+def decode_candles(data):
+    data = bytes(getattr(data, 'value', data))
+    if data[:2] != CANDLE_MAGIC or data[2] != VERSION:
+        raise ValueError("Not packed candles")
+
+    flags = data[3]
+    payload = zlib.decompress(data[4:]) if flags & FLAG_ZLIB else data[4:]
+
+    count, pos = _read_varint(payload, 0)
+    scale, pos = _read_varint(payload, pos)
+    offset_minutes, pos = _read_signed(payload, pos)
+    tz = timezone(timedelta(minutes=offset_minutes))
+
+    candles = []
+    micros = 0
+    for _ in range(count):
+        delta, pos = _read_signed(payload, pos)
+        micros += delta
+        candles.append({'start': (EPOCH + micros * ONE_MICROSECOND).astimezone(tz).isoformat()})
+
+    for name in CANDLE_COLUMNS:
+        scaled = 0
+        for candle in candles:
+            delta, pos = _read_signed(payload, pos)
+            scaled += delta
+            candle[name] = Decimal(scaled).scaleb(-scale)
+    return candles
@@ -1,21 +1,101 @@
 import json
-import boto3
 import os
 import base64
+import bisect
 from decimal import Decimal
 from datetime import datetime, timezone, timedelta
+from indicator_engine import (IndicatorEngine, NUMERIC_BACKENDS, DEFAULT_INDICATORS, DEFAULT_SIGNALS, SIGNAL_RULES,
+                              confirm_signal, detect_signal, indicator_names, to_decimal, EMA_SHORT, EMA_LONG, SMA_SHORT, SMA_LONG)
+from coin_state import CoinState, StateCache, VersionConflict
+from candles import CandleAggregator
+from trend_events import HISTORY_KINDS, write_events
+from instrumentation import Instrumentation
+from aws_clients import DynamoDBTable, get_client
+from read_models import coin_summary, merge_leaderboard, write_summaries
 
-# Boto3 clients
-dynamodb = boto3.resource('dynamodb')
-sns = boto3.client('sns')
+# Stage timings and DynamoDB/SNS call counts, flushed once per invocation
+metrics = Instrumentation('process_cryptostream')
+
+# Low-level clients, created on first use. SNS is only needed when a signal fires.
+def dynamodb_client():
+    return get_client('dynamodb', lambda client: metrics.instrument_client(client, 'dynamodb'))
+
+def sns_client():
+    return get_client('sns', lambda client: metrics.instrument_client(client, 'sns'))
 
 # Environment variables
 TABLE_NAME = os.environ['DYNAMODB_TABLE']
 SNS_TOPIC_ARN = os.environ['SNS_TOPIC_ARN']
 PRICE_HISTORY_LIMIT = 500
-
-# DynamoDB table object
-table = dynamodb.Table(TABLE_NAME)
+# 'list' keeps price_history as a list of maps; 'packed' stores one Binary
+# attribute (see price_history_codec.py) and migrates items as they are written
+PRICE_HISTORY_FORMAT = os.environ.get('PRICE_HISTORY_FORMAT', 'list')
+PRICE_HISTORY_PRICES = os.environ.get('PRICE_HISTORY_PRICES', 'fixed')
+PRICE_HISTORY_COMPRESS = os.environ.get('PRICE_HISTORY_COMPRESS', 'false').lower() == 'true'
+# With an events table the cross/profit histories live there and the trend
+# item keeps only the last HISTORY_TAIL_LIMIT entries of each
+EVENTS_TABLE = os.environ.get('EVENTS_TABLE')
+HISTORY_TAIL_LIMIT = int(os.environ.get('HISTORY_TAIL_LIMIT', '20'))
+# Dashboard summaries and the leaderboard (see read_models.py), refreshed
+# once per invocation for the coins it saved
+READ_MODEL_TABLE = os.environ.get('READ_MODEL_TABLE')
+# 'decimal' runs the indicator math exactly; 'float' uses binary floats and
+# converts to Decimal only for DynamoDB and SNS
+NUMERIC_BACKEND = os.environ.get('NUMERIC_BACKEND', 'decimal')
+NUMBER = NUMERIC_BACKENDS[NUMERIC_BACKEND]
+# Indicators computed on every tick (see indicator_engine.INDICATORS) and the
+# crossover signals traded on (see indicator_engine.SIGNAL_RULES)
+INDICATORS = [name.strip() for name in os.environ.get('INDICATORS', ','.join(DEFAULT_INDICATORS)).split(',')
+              if name.strip()]
+SIGNALS = [prefix.strip() for prefix in os.environ.get('SIGNALS', ','.join(DEFAULT_SIGNALS)).split(',')
+           if prefix.strip()]
+ENGINE_INDICATORS = indicator_names(INDICATORS, SIGNALS)
+TREND_STATUS = {'Golden Cross': 'Buy', 'Dead Cross': 'Sell', None: 'Hold'}
+# Whipsaw filter for the crossovers, off by default: a cross only counts once
+# the fast value is at least SIGNAL_MIN_SPREAD_BPS of the price past the slow
+# one on SIGNAL_CONFIRM_TICKS consecutive ticks (or candles), and each coin
+# signals at most once per SIGNAL_COOLDOWN seconds and rule
+SIGNAL_MIN_SPREAD_BPS = NUMBER(os.environ.get('SIGNAL_MIN_SPREAD_BPS', '0'))
+SIGNAL_CONFIRM_TICKS = int(os.environ.get('SIGNAL_CONFIRM_TICKS', '1'))
+SIGNAL_COOLDOWN = int(os.environ.get('SIGNAL_COOLDOWN', '0'))
+SIGNAL_FILTER = SIGNAL_MIN_SPREAD_BPS > 0 or SIGNAL_CONFIRM_TICKS > 1 or SIGNAL_COOLDOWN > 0
+# Candle timeframes (e.g. "1h,1d", see candles.TIMEFRAMES) whose closed
+# candles get their own indicators and signals on top of the per-tick ones
+CANDLE_TIMEFRAMES = [tf.strip() for tf in os.environ.get('CANDLE_TIMEFRAMES', '').split(',') if tf.strip()]
+CANDLE_HISTORY_LIMIT = int(os.environ.get('CANDLE_HISTORY_LIMIT', '250'))
+# Coins kept in memory between warm invocations (0 disables the cache)
+STATE_CACHE_SIZE = int(os.environ.get('STATE_CACHE_SIZE', '256'))
+MAX_WRITE_ATTEMPTS = int(os.environ.get('MAX_WRITE_ATTEMPTS', '3'))
+# A tick older than the newest stored one is put back in order if at most
+# LATE_TICK_WINDOW newer ticks are already stored, and dropped otherwise
+LATE_TICK_WINDOW = int(os.environ.get('LATE_TICK_WINDOW', '10'))
+# Shards whose last applied sequence number is kept per coin (newest first)
+SEQUENCE_CHECKPOINT_SHARDS = 16
+BATCH_PROCESSING = os.environ.get('BATCH_PROCESSING', 'true').lower() == 'true'
+# Cross-coin breadth (needs NumPy, see market_breadth.py). When the last
+# BREADTH_WINDOW seconds hold at least BREADTH_BURST_THRESHOLD crosses, an
+# invocation's alerts go out as one market summary instead of one per coin.
+MARKET_BREADTH = os.environ.get('MARKET_BREADTH', 'false').lower() == 'true'
+BREADTH_WINDOW = int(os.environ.get('BREADTH_WINDOW', '900'))
+BREADTH_BURST_THRESHOLD = int(os.environ.get('BREADTH_BURST_THRESHOLD', '5'))
+
+# DynamoDB table objects
+table = DynamoDBTable(TABLE_NAME, dynamodb_client)
+events_table = DynamoDBTable(EVENTS_TABLE, dynamodb_client) if EVENTS_TABLE else None
+read_model_table = DynamoDBTable(READ_MODEL_TABLE, dynamodb_client) if READ_MODEL_TABLE else None
+
+# Per-coin state shared by warm invocations of this container
+state_cache = StateCache(STATE_CACHE_SIZE)
+
+# Summaries of the coins saved during the current invocation, by coin_id
+pending_summaries = {}
+
+# Latest values of every coin this container has saved, for breadth metrics
+if MARKET_BREADTH:
+    from market_breadth import MarketSnapshot
+    market = MarketSnapshot(STATE_CACHE_SIZE)
+else:
+    market = None
 
 class DecimalEncoder(json.JSONEncoder):
     def default(self, obj):
@@ -27,28 +107,37 @@ def decode_kinesis_record(record):
     try:
         base64_data = record['kinesis']['data']
         decoded_data = base64.b64decode(base64_data).decode('utf-8')
-        return json.loads(decoded_data, parse_float=Decimal)
+        return json.loads(decoded_data, parse_float=NUMBER)
     except Exception as e:
         print(f"❌ Error decoding record: {e}")
         return None
 
-def update_price_history(coin_id, price, timestamp):
-    response = table.get_item(Key={'coin_id': coin_id})
-    item = response.get('Item', {})
-    history = item.get('price_history', [])
-
-    # Avoid appending if the last record is exactly the same
-    if history and history[-1]['price'] == price and history[-1]['timestamp'] == timestamp:
-        return history[-PRICE_HISTORY_LIMIT:], len(history[-PRICE_HISTORY_LIMIT:])
-
-    history.append({'price': price, 'timestamp': timestamp})
-    return history[-PRICE_HISTORY_LIMIT:], len(history[-PRICE_HISTORY_LIMIT:])
-
+def update_price_history(state, price, timestamp, volume=None):
+    # Adds one tick to the price history and the indicators. Returns 'newest',
+    # 'late' for a tick put back in order behind newer ones, or None for a
+    # timestamp already stored or a tick too late to insert.
+    history = state.price_history()
+    engine = state.engine or IndicatorEngine.restore(state.get('indicator_state'), history, NUMBER, ENGINE_INDICATORS)
+    state.engine = engine
+
+    moment = datetime.fromisoformat(timestamp)
+    if not history or moment > datetime.fromisoformat(history[-1]['timestamp']):
+        history.append({'price': price, 'timestamp': timestamp})
+        engine.update(price, timestamp, volume)
+        state.history = history[-PRICE_HISTORY_LIMIT:]
+        return 'newest'
+
+    recent = [datetime.fromisoformat(entry['timestamp']) for entry in history[-(LATE_TICK_WINDOW + 1):]]
+    position = bisect.bisect_left(recent, moment)
+    if position < len(recent) and recent[position] == moment:
+        return None
+    if not LATE_TICK_WINDOW or (position == 0 and len(recent) < len(history)):
+        return None
 
-EMA_SHORT = 50
-EMA_LONG = 200
-SMA_SHORT = 50
-SMA_LONG = 200
+    history.insert(len(history) - len(recent) + position, {'price': price, 'timestamp': timestamp})
+    state.history = history[-PRICE_HISTORY_LIMIT:]
+    engine.insert(state.history, price, timestamp, volume)
+    return 'late'
 
 def calculate_ema(prices, period):
     if len(prices) < period:
@@ -64,6 +153,8 @@ def calculate_sma(prices, period):
         return sum(prices) / len(prices)
     return sum(prices[-period:]) / Decimal(period)
 
+# Full recomputation over the stored history. The hot path uses the incremental
+# IndicatorEngine instead; this stays as the reference it must agree with.
 def calculate_moving_averages(history):
     prices = [p['price'] for p in history]
     ema_short = calculate_ema(prices[-EMA_SHORT:], EMA_SHORT)
@@ -72,339 +163,692 @@ def calculate_moving_averages(history):
     sma_long = calculate_sma(prices, SMA_LONG)
     return ema_short, ema_long, sma_short, sma_long
 
-def detect_signal(short_ma, long_ma, prev_short, prev_long):
-    if prev_short < prev_long and short_ma > long_ma:
-        return "Golden Cross"
-    elif prev_short > prev_long and short_ma < long_ma:
-        return "Dead Cross"
-    return None
-
-def store_to_dynamodb(coin_id, history, ema_short, ema_long, sma_short, sma_long, timestamp, trend_status, num_price_history):
-    table.update_item(
-        Key={'coin_id': coin_id},
-        UpdateExpression="""
-            SET price_history = :history,
-                ema_short = :ema_short,
-                ema_long = :ema_long,
-                sma_short = :sma_short,
-                sma_long = :sma_long,
-                last_updated = :last_updated,
-                trend_status = :trend_status,
-                num_price_history = :num_ph
-        """,
-        ExpressionAttributeValues={
-            ':history': history,
-            ':ema_short': str(round(ema_short, 5)),
-            ':ema_long': str(round(ema_long, 5)),
-            ':sma_short': str(round(sma_short, 5)),
-            ':sma_long': str(round(sma_long, 5)),
-            ':last_updated': timestamp,
-            ':trend_status': trend_status,
-            ':num_ph': num_price_history
-        }
-    )
-    print(f"✅ Updated {coin_id} trend data in DynamoDB")
+def stage_price_history(state):
+    state.stage_price_history(PRICE_HISTORY_FORMAT, PRICE_HISTORY_PRICES, PRICE_HISTORY_COMPRESS)
+
+def stage_candles(state):
+    for candles in state.candles.values():
+        candles.stage(state, PRICE_HISTORY_COMPRESS)
+
+def queue_outbox(state, alerts):
+    # History events and alerts wait on the item (`pending_events`,
+    # `pending_alerts`), saved in the same write as the Kinesis checkpoint,
+    # until they are delivered. A record skipped as already seen therefore
+    # never loses its side effects, and the trimmed tail never loses an entry.
+    if state.events:
+        state.set('pending_events', state.get('pending_events', []) + [list(event) for event in state.events])
+        state.events = []
+    if alerts:
+        state.set('pending_alerts', state.get('pending_alerts', []) + alerts)
+
+def flush_events(state):
+    # Runs after the item is saved, so only committed signals reach the event
+    # store. A failed write is retried after the coin's next save; event
+    # writes are idempotent, so writing one twice is harmless.
+    pending = state.get('pending_events')
+    if events_table is None or not pending:
+        return
+    try:
+        write_events(events_table, state.coin_id, [tuple(event) for event in pending])
+    except Exception as e:
+        print(f"❌ Error writing {len(pending)} events for {state.coin_id}, kept for its next save: {e}")
+        metrics.count('event_write_failures')
+        return
+    if not state.clear_queue(table, 'pending_events'):
+        state_cache.invalidate(state.coin_id)
+
+def after_save(state, saved=True):
+    # Post-save work for one coin. The item is already committed, so a failure
+    # here is logged and never stops the other coins or the batch's alerts.
+    try:
+        if saved:
+            stage_read_model(state)
+        state_cache.put(state)
+        observe_market(state)
+        flush_events(state)
+    except Exception as e:
+        print(f"❌ Error after saving {state.coin_id}: {e}")
+        state_cache.invalidate(state.coin_id)
+
+def load_state(coin_id):
+    with metrics.timer('load'):
+        state = state_cache.get(coin_id)
+        if state is not None:
+            metrics.count('cache_hits')
+            return state
+        return CoinState.load(table, coin_id)
+
+def store_to_dynamodb(state):
+    with metrics.timer('store'):
+        # Nothing is staged (or written) when every tick was a duplicate
+        if state.dirty:
+            stage_price_history(state)
+            stage_candles(state)
+        saved = state.save(table)
+        if saved:
+            print(f"✅ Updated {state.coin_id} trend data in DynamoDB")
+        after_save(state, saved)
+
+def observe_market(state):
+    # Copies a saved coin's price, long SMA and trend direction (fast vs slow
+    # MA of the first signal rule) into the breadth snapshot. Breadth is only
+    # a view, so its errors never fail the batch.
+    if market is None or not state.price_history():
+        return
+    try:
+        trend = 0
+        if SIGNALS:
+            fast = state.get(SIGNAL_RULES[SIGNALS[0]]['fast'])
+            slow = state.get(SIGNAL_RULES[SIGNALS[0]]['slow'])
+            if fast is not None and slow is not None:
+                trend = (Decimal(fast) > Decimal(slow)) - (Decimal(fast) < Decimal(slow))
+        market.update(state.coin_id, state.price_history()[-1]['price'], state.get('sma_long'), trend)
+    except Exception as e:
+        print(f"❌ Error updating market breadth for {state.coin_id}: {e}")
+
+def stage_read_model(state):
+    if read_model_table is not None and state.price_history():
+        pending_summaries[state.coin_id] = coin_summary(state.coin_id, state.item, state.price_history()[-1]['price'],
+                                                        ENGINE_INDICATORS, SIGNALS)
+
+def update_read_models(alerts):
+    # One batch of summary puts and one leaderboard update per touched shard
+    # per invocation. The trend items are already saved, so a failure here
+    # only leaves the dashboards behind until the coins' next ticks.
+    if read_model_table is None or not pending_summaries:
+        return
+    summaries = list(pending_summaries.values())
+    pending_summaries.clear()
+    crosses = [{'coin': alert['coin_id'], 'signal': alert['signal'], 'price': str(round(alert['price'], 5)),
+                'timestamp': alert['timestamp']} for alert in alerts]
+    try:
+        with metrics.timer('read_models'):
+            write_summaries(read_model_table, summaries)
+            merge_leaderboard(read_model_table, summaries, crosses, SIGNALS)
+    except Exception as e:
+        print(f"❌ Error updating read models: {e}")
 
-def publish_sns_alert(signal, coin_id, price, ema_short, ema_long, sma_short, sma_long, timestamp, trend_status):
+def publish_sns_alert(signal, coin_id, price, timestamp, trend_status, indicators, crosses):
     message = {
         'coin': coin_id,
         'signal': signal,
         'trend_status': trend_status,
-        'price': str(round(price, 5)),
-        'ema_short': str(round(ema_short, 5)),
-        'ema_long': str(round(ema_long, 5)),
-        'sma_short': str(round(sma_short, 5)),
-        'sma_long': str(round(sma_long, 5)),
-        'timestamp': timestamp
+        'price': str(round(price, 5))
     }
-    sns.publish(
-        TopicArn=SNS_TOPIC_ARN,
-        Message=json.dumps(message),
-        Subject=f'{signal} detected for {coin_id}'
-    )
+    message.update({name: str(round(value, 5)) for name, value in indicators.items()})
+    message['timestamp'] = timestamp
+    # Which two values each signal compares, for the Discord forwarder
+    message['crosses'] = crosses
+    with metrics.timer('publish'):
+        sns_client().publish(
+            TopicArn=SNS_TOPIC_ARN,
+            Message=json.dumps(message),
+            Subject=f'{signal} detected for {coin_id}'
+        )
+    metrics.count('alerts')
     print(f"📢 SNS Alert sent: {signal} for {coin_id}")
 
-def lambda_handler(event, context):
-    for record in event['Records']:
+def publish_market_summary(alerts, breadth, timestamp):
+    message = {
+        'type': 'market_summary',
+        'coins': breadth['coins'],
+        'pct_above_sma_long': breadth['pct_above_sma_long'],
+        'golden_crosses': breadth['golden_crosses'],
+        'dead_crosses': breadth['dead_crosses'],
+        'cap_weighted_trend': breadth['cap_weighted_trend'],
+        'window_minutes': BREADTH_WINDOW // 60,
+        'signals': [{'coin': alert['coin_id'], 'signal': alert['signal'], 'price': str(round(alert['price'], 5))}
+                    for alert in alerts],
+        'timestamp': timestamp
+    }
+    with metrics.timer('publish'):
+        sns_client().publish(
+            TopicArn=SNS_TOPIC_ARN,
+            Message=json.dumps(message),
+            Subject=f'Market summary: {len(alerts)} signals'
+        )
+    metrics.count('summary_alerts')
+    metrics.count('summarized_alerts', len(alerts))
+    print(f"📢 SNS market summary sent for {len(alerts)} signals")
+
+def alert_crosses(alerts):
+    # (signal, timestamp) of each Golden or Dead Cross the alerts report
+    return [(signal, alert['timestamp']) for alert in alerts for fired in alert['signal'].split(', ')
+            for signal in [fired.rsplit(': ', 1)[-1]] if signal in ('Golden Cross', 'Dead Cross')]
+
+def record_crosses(alerts):
+    # Crosses enter the breadth window once their alerts are published, so a
+    # retried alert is not counted twice
+    if market is None:
+        return
+    try:
+        for signal, timestamp in alert_crosses(alerts):
+            market.add_cross(signal, timestamp)
+    except Exception as e:
+        print(f"❌ Error recording crosses for market breadth: {e}")
+
+def market_burst(alerts):
+    # Returns (breadth, timestamp) when the alerts' crosses are part of a
+    # burst across the market, else None. On a breadth error the alerts
+    # simply go out one by one.
+    if market is None or not alerts:
+        return None
+    try:
+        latest = max(alerts, key=lambda alert: datetime.fromisoformat(alert['timestamp']))['timestamp']
+        breadth = market.summary(latest, BREADTH_WINDOW, alert_crosses(alerts))
+    except Exception as e:
+        print(f"❌ Error computing market breadth: {e}")
+        return None
+    if len(alerts) > 1 and breadth['golden_crosses'] + breadth['dead_crosses'] >= BREADTH_BURST_THRESHOLD:
+        return breadth, latest
+    return None
+
+def deliver_alerts(states):
+    # Publishes the alerts queued on saved states: one SNS message per alert,
+    # or a single market summary when they arrive in a burst of crosses across
+    # the market. A coin's queue is cleared once its alerts are out; after a
+    # failed publish they stay queued and go out after the coin's next save.
+    # Returns the alerts that were published.
+    queued = [(state, state.get('pending_alerts')) for state in states if state.get('pending_alerts')]
+    alerts = [alert for _, coin_alerts in queued for alert in coin_alerts]
+    delivered = []
+    burst = market_burst(alerts)
+    if burst is not None:
         try:
+            publish_market_summary(alerts, *burst)
+            delivered = queued
+        except Exception as e:
+            print(f"❌ Error publishing market summary, alerts kept for the next save: {e}")
+            metrics.count('alert_publish_failures')
+    else:
+        for state, coin_alerts in queued:
+            try:
+                for alert in coin_alerts:
+                    publish_sns_alert(**alert)
+                delivered.append((state, coin_alerts))
+            except Exception as e:
+                print(f"❌ Error publishing alerts for {state.coin_id}, kept for its next save: {e}")
+                metrics.count('alert_publish_failures')
+
+    for state, _ in delivered:
+        try:
+            if not state.clear_queue(table, 'pending_alerts'):
+                # Another invocation saved the coin first; the cached copy
+                # still holds the published alerts
+                state_cache.invalidate(state.coin_id)
+        except Exception as e:
+            print(f"❌ Error clearing published alerts of {state.coin_id}: {e}")
+            state_cache.invalidate(state.coin_id)
+    published = [alert for _, coin_alerts in delivered for alert in coin_alerts]
+    record_crosses(published)
+    return published
+
+def migrate_history_to_events(state, prefix):
+    # Items written before the event store still carry their full lists. Queue
+    # every legacy entry once so nothing is lost when the lists are trimmed.
+    if state.get(f'{prefix}_history_events_migrated'):
+        return
+    for kind in HISTORY_KINDS:
+        for entry in state.get(f'{prefix}_{kind}_history', []):
+            if kind == 'profit':
+                timestamp = entry.get(f'{prefix}_dead_cross_history_last', {}).get('timestamp')
+            else:
+                timestamp = entry.get('timestamp')
+            if timestamp:
+                state.events.append((f'{prefix}_{kind}', timestamp, entry))
+    state.set(f'{prefix}_history_events_migrated', True)
+
+def append_history(state, prefix, kind, entry, timestamp, newest_first=False):
+    # Adds one entry to a cross/profit history. With an event store configured
+    # the entry is also queued as an event and the item keeps only the tail.
+    name = f'{prefix}_{kind}_history'
+    history = state.get(name, [])
+    if newest_first:
+        history.insert(0, entry)
+    else:
+        history.append(entry)
+
+    if events_table is not None:
+        state.events.append((f'{prefix}_{kind}', timestamp, entry))
+        history = history[:HISTORY_TAIL_LIMIT] if newest_first else history[-HISTORY_TAIL_LIMIT:]
+    state.set(name, history)
+    return history
+
+def next_count(state, name, legacy_count):
+    # Counters replace len() of the history lists, which are now trimmed
+    count = state.get(name)
+    return Decimal(legacy_count if count is None else count) + 1
+
+def apply_cross_signal(state, prefix, signal, price, timestamp):
+    # Golden/dead cross bookkeeping for one MA pair ("ema" or "sma"), in memory
+    label = prefix.upper()
+    holding = bool(state.get(f'{prefix}_status_holding', False))
+    if events_table is not None:
+        migrate_history_to_events(state, prefix)
+
+    if signal == "Golden Cross":
+        if not holding:
+            num_golden = next_count(state, f'{prefix}_num_golden_crosses',
+                                    len(state.get(f'{prefix}_golden_cross_history', [])))
+            append_history(state, prefix, 'golden_cross', {
+                'timestamp': timestamp,
+                'price': price
+            }, timestamp)
+            state.update({
+                f'{prefix}_last_golden_cross_price': price,
+                f'{prefix}_last_golden_cross_timestamp': timestamp,
+                f'{prefix}_status_holding': True,
+                f'{prefix}_num_golden_crosses': num_golden
+            })
+            print(f"💰 {label} Buy signal saved at price {price} for {state.coin_id}")
+        else:
+            print(f"🔁 Already holding {label} for {state.coin_id}, skipping buy")
+
+    elif signal == "Dead Cross":
+        buy_price = Decimal(state.get(f'{prefix}_last_golden_cross_price', 0))
+
+        if holding and buy_price:
+            profit = price - buy_price
+            profit_pct = (profit / buy_price) * Decimal('100')
+
+            golden_history = state.get(f'{prefix}_golden_cross_history', [])
+            num_dead = next_count(state, f'{prefix}_num_dead_crosses',
+                                  len(state.get(f'{prefix}_dead_cross_history', [])))
+            num_getprofit = next_count(state, f'{prefix}_num_profits',
+                                       len(state.get(f'{prefix}_profit_history', [])))
+
+            append_history(state, prefix, 'dead_cross', {
+                'timestamp': timestamp,
+                'price': price
+            }, timestamp)
+
+            new_profit_entry = {
+                "num_getprofit": num_getprofit,
+                f"{prefix}_profit": str(round(profit, 6)),
+                f"{prefix}_profit_percentage": str(round(profit_pct, 4)),
+                f"{prefix}_dead_cross_history_last": {
+                    "price": str(price),
+                    "timestamp": timestamp
+                },
+                f"{prefix}_golden_cross_history_last": golden_history[-1] if golden_history else {}
+            }
+            append_history(state, prefix, 'profit', new_profit_entry, timestamp, newest_first=True)
+
+            state.update({
+                f'{prefix}_profit': profit,
+                f'{prefix}_profit_percentage': profit_pct,
+                f'{prefix}_status_holding': False,
+                f'{prefix}_last_dead_cross_price': price,
+                f'{prefix}_last_dead_cross_timestamp': timestamp,
+                f'{prefix}_num_dead_crosses': num_dead,
+                f'{prefix}_num_profits': num_getprofit
+            })
+            print(f"📈 {label} Sold {state.coin_id} at {price}, Profit: {profit:.5f}, Profit%: {profit_pct:.2f}%")
+        else:
+            print(f"⚠️ Not holding {label} for {state.coin_id}, skipping sell")
+
+    num_crosses = next_count(state, f'{prefix}_num_crosses', len(state.get(f'{prefix}_cross_history', [])))
+    append_history(state, prefix, 'cross', {
+        'timestamp': timestamp,
+        'price': price,
+        'signal': signal
+    }, timestamp)
+    state.set(f'{prefix}_num_crosses', num_crosses)
+
+def detect_rule_signal(previous, values, prefix):
+    # Crossover of one signal rule against the values stored on the previous
+    # tick (or candle)
+    fast, slow = SIGNAL_RULES[prefix]['fast'], SIGNAL_RULES[prefix]['slow']
+    if values[fast] is None or values[slow] is None:
+        return None
+
+    # First time: no data in DynamoDB
+    if previous.get(fast) is None or previous.get(slow) is None:
+        prev_fast, prev_slow = values[fast], values[slow]
+    else:
+        prev_fast, prev_slow = NUMBER(previous[fast]), NUMBER(previous[slow])
+    return detect_signal(values[fast], values[slow], prev_fast, prev_slow)
+
+def filter_rule_signal(state, previous, values, prefix, key, price, timestamp):
+    # detect_rule_signal behind the whipsaw filter. Its state is one short
+    # "side,pending,last" string per rule in the item's `signal_filter` map.
+    fast, slow = SIGNAL_RULES[prefix]['fast'], SIGNAL_RULES[prefix]['slow']
+    if values[fast] is None or values[slow] is None:
+        return None
+
+    filters = dict(state.get('signal_filter', {}))
+    if key in filters:
+        side, pending, last = filters[key].split(',')
+        filter_state = (int(side), int(pending), int(last) if last else None)
+    else:
+        # First filtered tick: start from the side the stored values are on
+        prev_fast, prev_slow = previous.get(fast), previous.get(slow)
+        if prev_fast is None or prev_slow is None:
+            filter_state = (0, 0, None)
+        else:
+            filter_state = ((NUMBER(prev_fast) > NUMBER(prev_slow)) - (NUMBER(prev_fast) < NUMBER(prev_slow)), 0, None)
+
+    epoch = int(datetime.fromisoformat(timestamp).timestamp())
+    signal, (side, pending, last) = confirm_signal(
+        values[fast], values[slow], NUMBER(price), filter_state, epoch,
+        SIGNAL_MIN_SPREAD_BPS, SIGNAL_CONFIRM_TICKS, SIGNAL_COOLDOWN
+    )
+    packed = f"{side},{pending},{'' if last is None else last}"
+    if filters.get(key) != packed:
+        filters[key] = packed
+        state.set('signal_filter', filters)
+    if signal is None and detect_rule_signal(previous, values, prefix):
+        metrics.count('filtered_crosses')
+    return signal
+
+def evaluate_signals(state, previous, values, price, timestamp, timeframe=None):
+    # Detects every configured crossover, records the ones that fired and
+    # returns the stored values, the trend status and the alert, if any.
+    # Candle timeframes keep their own bookkeeping under e.g. "ema_1d_...".
+    if SIGNAL_FILTER:
+        signals = {prefix: filter_rule_signal(state, previous, values, prefix,
+                                              f"{prefix}_{timeframe}" if timeframe else prefix, price, timestamp)
+                   for prefix in SIGNALS}
+    else:
+        signals = {prefix: detect_rule_signal(previous, values, prefix) for prefix in SIGNALS}
+    labels = {prefix: f"{prefix.upper()} {timeframe}" if timeframe else prefix.upper() for prefix in SIGNALS}
+    trend_status = ", ".join(f"{labels[prefix]}: {TREND_STATUS[signal]}" for prefix, signal in signals.items())
+
+    # Decimal from here on: these values are stored and published
+    values = {name: to_decimal(value) for name, value in values.items() if value is not None}
+
+    for prefix, signal in signals.items():
+        if signal:
+            apply_cross_signal(state, f"{prefix}_{timeframe}" if timeframe else prefix, signal, price, timestamp)
+
+    if not any(signals.values()):
+        return values, trend_status, None
+    suffix = f"_{timeframe}" if timeframe else ''
+    return values, trend_status, {
+        'signal': ", ".join(f"{labels[prefix]}: {signal}" for prefix, signal in signals.items()),
+        'coin_id': state.coin_id,
+        'price': price,
+        'timestamp': timestamp,
+        'trend_status': trend_status,
+        'indicators': {f"{name}{suffix}": value for name, value in values.items()},
+        'crosses': {labels[prefix]: [SIGNAL_RULES[prefix]['fast'] + suffix, SIGNAL_RULES[prefix]['slow'] + suffix]
+                    for prefix in SIGNALS}
+    }
+
+def process_candles(state, price, timestamp, volume, late=False):
+    # Rolls the tick into each timeframe's open candle. Only a candle that
+    # closes updates that timeframe's indicators and can signal.
+    alerts = []
+    for timeframe in CANDLE_TIMEFRAMES:
+        candles = state.candles.get(timeframe)
+        if candles is None:
+            candles = state.candles[timeframe] = CandleAggregator.from_state(
+                state, timeframe, NUMBER, ENGINE_INDICATORS, CANDLE_HISTORY_LIMIT)
+        closed = candles.add_tick(price, timestamp, volume, late)
+        if closed is None:
+            continue
+
+        values, trend_status, alert = evaluate_signals(
+            state, candles.values, candles.engine.values(), closed['close'], closed['start'], timeframe)
+        candles.values = {name: str(round(value, 5)) for name, value in values.items()}
+        candles.trend_status = trend_status
+        if alert:
+            alerts.append(alert)
+    return alerts
+
+def process_tick(state, price, timestamp, volume=None):
+    # Applies one price tick to the in-memory state and returns the SNS
+    # alerts to publish once the state is saved
+    placed = update_price_history(state, price, timestamp, volume)
+    if placed is None:
+        metrics.count('dropped_ticks')
+        return []
+    engine = state.engine
+
+    if placed == 'late':
+        # The stored values follow the recomputed indicators, but crossovers
+        # are only judged on the newest tick
+        metrics.count('late_ticks')
+        state.update({name: str(round(to_decimal(value), 5)) for name, value in engine.values().items()
+                      if value is not None})
+        state.update({
+            'num_price_history': len(state.history),
+            'indicator_state': engine.to_state()
+        })
+        process_candles(state, price, timestamp, volume, late=True)
+        return []
+
+    values, trend_status, alert = evaluate_signals(state, state.item, engine.values(), price, timestamp)
+
+    state.update({name: str(round(value, 5)) for name, value in values.items()})
+    state.update({
+        'last_updated': timestamp,
+        'trend_status': trend_status,
+        'num_price_history': len(state.history),
+        'indicator_state': engine.to_state()
+    })
+
+    alerts = [alert] if alert else []
+    alerts.extend(process_candles(state, price, timestamp, volume))
+    return alerts
+
+def parse_tick(payload):
+    coin_id = payload['id']
+    price = Decimal(str(payload['price']))
+    # 24h traded volume reported with the price, used by the VWAP indicator
+    volume = Decimal(str(payload['volume'])) if payload.get('volume') is not None else None
+    utc_time = datetime.fromisoformat(payload['timestamp'].replace("Z", "+00:00"))
+    bangkok_time = utc_time.astimezone(timezone(timedelta(hours=7)))
+    return coin_id, price, bangkok_time.isoformat(), volume
+
+def record_source(record):
+    # (shard id, sequence number) of a Kinesis record; eventID is
+    # "<shard id>:<sequence number>"
+    try:
+        return record['eventID'].rsplit(':', 1)[0], int(record['kinesis']['sequenceNumber'])
+    except (KeyError, ValueError):
+        return None
+
+def unseen_ticks(state, ticks):
+    # Drops the ticks of Kinesis records this coin has already applied (a
+    # retried batch, or a redelivery around a shard split) and moves its
+    # per-shard checkpoint forward. The checkpoint is saved with the item,
+    # under the same version guard.
+    checkpoints = state.get('kinesis_sequences') or {}
+    latest = {}
+    fresh = []
+    for tick in ticks:
+        source = tick[3]
+        if source is not None:
+            shard_id, sequence = source
+            if shard_id in checkpoints and sequence <= int(checkpoints[shard_id]):
+                continue
+            latest[shard_id] = max(sequence, latest.get(shard_id, sequence))
+        fresh.append(tick)
+
+    if len(fresh) < len(ticks):
+        metrics.count('duplicate_records', len(ticks) - len(fresh))
+    if latest:
+        checkpoints = dict(checkpoints)
+        checkpoints.update({shard_id: str(sequence) for shard_id, sequence in latest.items()})
+        # Sequence numbers grow over time, so the smallest belong to closed shards
+        newest = sorted(checkpoints, key=lambda shard_id: int(checkpoints[shard_id]), reverse=True)
+        state.set('kinesis_sequences', {shard_id: checkpoints[shard_id]
+                                        for shard_id in newest[:SEQUENCE_CHECKPOINT_SHARDS]})
+    return fresh
+
+def save_with_retry(state, replay):
+    # Save once; a version conflict means another invocation wrote this coin
+    # first, so replay on fresh state. Returns the saved state.
+    # The state may be the cached copy, so it is dropped from the cache
+    # whenever this fails part-way through.
+    coin_id = state.coin_id
+    try:
+        replay(state)
+        for attempt in range(MAX_WRITE_ATTEMPTS):
+            try:
+                store_to_dynamodb(state)
+                return state
+            except VersionConflict:
+                print(f"🔁 Version conflict for {coin_id}, retrying ({attempt + 1}/{MAX_WRITE_ATTEMPTS})")
+                metrics.count('version_conflicts')
+                state_cache.invalidate(coin_id)
+                with metrics.timer('load'):
+                    state = CoinState.load(table, coin_id)
+                replay(state)
+    except Exception:
+        state_cache.invalidate(coin_id)
+        raise
+    state_cache.invalidate(coin_id)
+    raise VersionConflict(f"Gave up on {coin_id} after {MAX_WRITE_ATTEMPTS} attempts")
+
+def group_ticks(records):
+    # Decodes a Kinesis batch into {coin_id: [(price, timestamp, volume, source), ...]}
+    # in timestamp order, where source is the record's (shard id, sequence number)
+    ticks_by_coin = {}
+    with metrics.timer('decode'):
+        for record in records:
             payload = decode_kinesis_record(record)
             if not payload:
                 continue
+            try:
+                coin_id, price, timestamp, volume = parse_tick(payload)
+            except Exception as e:
+                print(f"❌ Error processing record: {e}")
+                print(f"🔍 Raw record: {record}")
+                continue
+            ticks_by_coin.setdefault(coin_id, []).append((price, timestamp, volume, record_source(record)))
+            observe_market_cap(coin_id, payload)
 
-            coin_id = payload['id']
-            price = Decimal(str(payload['price']))
-            utc_time = datetime.fromisoformat(payload['timestamp'].replace("Z", "+00:00"))
-            bangkok_time = utc_time.astimezone(timezone(timedelta(hours=7)))
-            timestamp = bangkok_time.isoformat()
-
-            history, num_price_history = update_price_history(coin_id, price, timestamp)
-            ema_short, ema_long, sma_short, sma_long = calculate_moving_averages(history)
-
-            # Try to fetch previous data
-            response = table.get_item(Key={'coin_id': coin_id})
-            item = response.get('Item')
-
-            # First time: no data in DynamoDB
-            if not item:
-                prev_ema_short = ema_short  
-                prev_ema_long = ema_long
-                prev_sma_short = sma_short
-                prev_sma_long = sma_long
-            else:
-                prev_ema_short = Decimal(item['ema_short'])
-                prev_ema_long = Decimal(item['ema_long'])
-                prev_sma_short = Decimal(item['sma_short'])
-                prev_sma_long = Decimal(item['sma_long'])
-
-            ema_signal = detect_signal(ema_short, ema_long, prev_ema_short, prev_ema_long)
-            sma_signal = detect_signal(sma_short, sma_long, prev_sma_short, prev_sma_long)
-
-            ema_trend_status = 'Buy' if ema_signal == 'Golden Cross' else 'Sell' if ema_signal == 'Dead Cross' else 'Hold'
-            sma_trend_status = 'Buy' if sma_signal == 'Golden Cross' else 'Sell' if sma_signal == 'Dead Cross' else 'Hold'
-            trend_status_ema = ema_trend_status
-            trend_status_sma = sma_trend_status
-            trend_status = f"EMA: {trend_status_ema}, SMA: {trend_status_sma}"
-
-            store_to_dynamodb(
-                coin_id=coin_id,
-                history=history,
-                ema_short=ema_short,
-                ema_long=ema_long,
-                sma_short=sma_short,
-                sma_long=sma_long,
-                timestamp=timestamp,
-                trend_status=trend_status,
-                num_price_history=num_price_history
+        for ticks in ticks_by_coin.values():
+            ticks.sort(key=lambda tick: datetime.fromisoformat(tick[1]))
+    return ticks_by_coin
+
+def observe_market_cap(coin_id, payload):
+    if market is None or payload.get('market_cap') is None:
+        return
+    try:
+        market.set_market_cap(coin_id, payload['market_cap'])
+    except Exception as e:
+        print(f"❌ Error updating market breadth for {coin_id}: {e}")
+
+def replay_ticks(state, ticks):
+    alerts = []
+    with metrics.timer('compute'):
+        ticks = unseen_ticks(state, ticks)
+        for price, timestamp, volume, source in ticks:
+            alerts.extend(process_tick(state, price, timestamp, volume))
+        queue_outbox(state, alerts)
+    metrics.count('ticks', len(ticks))
+    return alerts
+
+def process_batch(records):
+    # One BatchGetItem for every coin in the batch, all ticks replayed in
+    # memory, then one transactional write per chunk of coins
+    ticks_by_coin = group_ticks(records)
+    if not ticks_by_coin:
+        return
+
+    # Warm-cache hits need no read at all; the rest come from one BatchGetItem
+    states = {}
+    with metrics.timer('load'):
+        for coin_id in ticks_by_coin:
+            state = state_cache.get(coin_id)
+            if state is not None:
+                states[coin_id] = state
+        metrics.count('cache_hits', len(states))
+        missing = [coin_id for coin_id in ticks_by_coin if coin_id not in states]
+        if missing:
+            states.update(CoinState.load_many(table, missing))
+
+    for coin_id, ticks in ticks_by_coin.items():
+        try:
+            replay_ticks(states[coin_id], ticks)
+        except Exception as e:
+            print(f"❌ Error processing {coin_id} ticks: {e}")
+            state_cache.invalidate(coin_id)
+            del states[coin_id]
+
+    changed = [state for state in states.values() if state.dirty]
+    # Committed states, whose queued alerts can go out: the unchanged ones
+    # (e.g. a batch of redelivered records) and those saved below
+    saved = {coin_id: state for coin_id, state in states.items() if not state.dirty}
+    with metrics.timer('store'):
+        try:
+            for state in changed:
+                stage_price_history(state)
+                stage_candles(state)
+            conflicts = CoinState.save_many(table, changed)
+        except Exception:
+            for state in changed:
+                state_cache.invalidate(state.coin_id)
+            raise
+
+        for state in changed:
+            if state not in conflicts:
+                print(f"✅ Updated {state.coin_id} trend data in DynamoDB")
+                after_save(state)
+                saved[state.coin_id] = state
+
+    for state in conflicts:
+        coin_id = state.coin_id
+        print(f"🔁 Version conflict for {coin_id}, replaying batch ticks")
+        metrics.count('version_conflicts')
+        state_cache.invalidate(coin_id)
+        try:
+            with metrics.timer('load'):
+                fresh_state = CoinState.load(table, coin_id)
+            saved[coin_id] = save_with_retry(
+                fresh_state,
+                lambda fresh: replay_ticks(fresh, ticks_by_coin[coin_id])
             )
+        except Exception as e:
+            print(f"❌ Error saving {coin_id}: {e}")
+
+    update_read_models(deliver_alerts(saved.values()))
+
+def log_cache_stats():
+    stats = state_cache.stats()
+    print(f"🗃️ State cache: {stats['hits']} hits, {stats['misses']} misses, "
+          f"hit rate {stats['hit_rate']:.2%}, {stats['size']} coins cached")
 
-            if ema_signal:
-                response = table.get_item(Key={'coin_id': coin_id})
-                item = response.get('Item', {})
-                holding = bool(item.get('ema_status_holding', False))
-
-                if ema_signal == "Golden Cross":
-                    if not holding:
-                        ema_golden_history = item.get('ema_golden_cross_history', [])
-                        ema_golden_history.append({
-                            'timestamp': timestamp,
-                            'price': price
-                        })
-                        num_golden = Decimal(len(ema_golden_history))
-                        table.update_item(
-                            Key={'coin_id': coin_id},
-                            UpdateExpression="""
-                                SET ema_last_golden_cross_price = :p,
-                                    ema_last_golden_cross_timestamp = :t,
-                                    ema_status_holding = :h,
-                                    ema_golden_cross_history = :gh,
-                                    ema_num_golden_crosses = :ng
-                            """,
-                            ExpressionAttributeValues={
-                                ':p': price,
-                                ':t': timestamp,
-                                ':h': True,
-                                ':gh': ema_golden_history,
-                                ':ng': num_golden
-                            }
-                        )
-                        print(f"💰 EMA Buy signal saved at price {price} for {coin_id}")
-                    else:
-                        print(f"🔁 Already holding EMA for {coin_id}, skipping buy")
-
-                elif ema_signal == "Dead Cross":
-                    buy_price = Decimal(item.get('ema_last_golden_cross_price', 0))
-
-                    if holding and buy_price:
-                        profit = price - buy_price
-                        profit_pct = (profit / buy_price) * Decimal('100')
-
-                        ema_dead_history = item.get('ema_dead_cross_history', [])
-                        ema_golden_history = item.get('ema_golden_cross_history', [])
-                        ema_profit_history = item.get('ema_profit_history', [])
-
-                        ema_dead_history.append({
-                            'timestamp': timestamp,
-                            'price': price
-                        })
-                        num_dead = Decimal(len(ema_dead_history))
-                        num_getprofit = len(ema_profit_history) + 1
-
-                        new_profit_entry = {
-                            "num_getprofit": num_getprofit,
-                            "ema_profit": str(round(profit, 6)),
-                            "ema_profit_percentage": str(round(profit_pct, 4)),
-                            "ema_dead_cross_history_last": {
-                                "price": str(price),
-                                "timestamp": timestamp
-                            },
-                            "ema_golden_cross_history_last": ema_golden_history[-1] if ema_golden_history else {}
-                        }
-
-                        ema_profit_history.insert(0, new_profit_entry)
-
-                        table.update_item(
-                            Key={'coin_id': coin_id},
-                            UpdateExpression="""
-                                SET ema_profit = :profit,
-                                    ema_profit_percentage = :pct,
-                                    ema_status_holding = :h,
-                                    ema_last_dead_cross_price = :p,
-                                    ema_last_dead_cross_timestamp = :t,
-                                    ema_dead_cross_history = :dh,
-                                    ema_num_dead_crosses = :nd,
-                                    ema_profit_history = :ph
-                            """,
-                            ExpressionAttributeValues={
-                                ':profit': profit,
-                                ':pct': profit_pct,
-                                ':h': False,
-                                ':p': price,
-                                ':t': timestamp,
-                                ':dh': ema_dead_history,
-                                ':nd': num_dead,
-                                ':ph': ema_profit_history
-                            }
-                        )
-                        print(f"📈 EMA Sold {coin_id} at {price}, Profit: {profit:.5f}, Profit%: {profit_pct:.2f}%")
-                    else:
-                        print(f"⚠️ Not holding EMA for {coin_id}, skipping sell")
-
-                response = table.get_item(Key={'coin_id': coin_id})
-                item = response.get('Item', {})
-                ema_history = item.get('ema_cross_history', [])
-                ema_history.append({
-                    'timestamp': timestamp,
-                    'price': price,
-                    'signal': ema_signal
-                })
-                table.update_item(
-                    Key={'coin_id': coin_id},
-                    UpdateExpression="SET ema_cross_history = :hist",
-                    ExpressionAttributeValues={':hist': ema_history}
-                )
-
-            if sma_signal:
-                response = table.get_item(Key={'coin_id': coin_id})
-                item = response.get('Item', {})
-                holding = bool(item.get('sma_status_holding', False))
-
-                if sma_signal == "Golden Cross":
-                    if not holding:
-                        sma_golden_history = item.get('sma_golden_cross_history', [])
-                        sma_golden_history.append({
-                            'timestamp': timestamp,
-                            'price': price
-                        })
-                        num_golden = Decimal(len(sma_golden_history))
-                        table.update_item(
-                            Key={'coin_id': coin_id},
-                            UpdateExpression="""
-                                SET sma_last_golden_cross_price = :p,
-                                    sma_last_golden_cross_timestamp = :t,
-                                    sma_status_holding = :h,
-                                    sma_golden_cross_history = :gh,
-                                    sma_num_golden_crosses = :ng
-                            """,
-                            ExpressionAttributeValues={
-                                ':p': price,
-                                ':t': timestamp,
-                                ':h': True,
-                                ':gh': sma_golden_history,
-                                ':ng': num_golden
-                            }
-                        )
-                        print(f"💰 SMA Buy signal saved at price {price} for {coin_id}")
-                    else:
-                        print(f"🔁 Already holding SMA for {coin_id}, skipping buy")
-
-                elif sma_signal == "Dead Cross":
-                    buy_price = Decimal(item.get('sma_last_golden_cross_price', 0))
-                    if holding and buy_price:
-                        profit = price - buy_price
-                        profit_pct = (profit / buy_price) * Decimal('100')
-
-                        sma_dead_history = item.get('sma_dead_cross_history', [])
-                        sma_golden_history = item.get('sma_golden_cross_history', [])
-                        sma_profit_history = item.get('sma_profit_history', [])
-
-                        sma_dead_history.append({
-                            'timestamp': timestamp,
-                            'price': price
-                        })
-                        num_dead = Decimal(len(sma_dead_history))
-
-                        num_getprofit = len(sma_profit_history) + 1
-
-                        new_profit_entry = {
-                            "num_getprofit": num_getprofit,
-                            "sma_profit": str(round(profit, 6)),
-                            "sma_profit_percentage": str(round(profit_pct, 4)),
-                            "sma_dead_cross_history_last": {
-                                "price": str(price),
-                                "timestamp": timestamp
-                            },
-                            "sma_golden_cross_history_last": sma_golden_history[-1] if sma_golden_history else {}
-                        }
-
-                        sma_profit_history.insert(0, new_profit_entry)
-
-                        table.update_item(
-                            Key={'coin_id': coin_id},
-                            UpdateExpression="""
-                                SET sma_profit = :profit,
-                                    sma_profit_percentage = :pct,
-                                    sma_status_holding = :h,
-                                    sma_last_dead_cross_price = :p,
-                                    sma_last_dead_cross_timestamp = :t,
-                                    sma_dead_cross_history = :dh,
-                                    sma_num_dead_crosses = :nd,
-                                    sma_profit_history = :ph
-                            """,
-                            ExpressionAttributeValues={
-                                ':profit': profit,
-                                ':pct': profit_pct,
-                                ':h': False,
-                                ':p': price,
-                                ':t': timestamp,
-                                ':dh': sma_dead_history,
-                                ':nd': num_dead,
-                                ':ph': sma_profit_history
-                            }
-                        )
-                        print(f"📈 SMA Sold {coin_id} at {price}, Profit: {profit:.5f}, Profit%: {profit_pct:.2f}%")
-                    else:
-                        print(f"⚠️ Not holding SMA for {coin_id}, skipping sell")
-
-                sma_history = item.get('sma_cross_history', [])
-                sma_history.append({
-                    'timestamp': timestamp,
-                    'price': price,
-                    'signal': sma_signal
-                })
-                table.update_item(
-                    Key={'coin_id': coin_id},
-                    UpdateExpression="SET sma_cross_history = :hist",
-                    ExpressionAttributeValues={':hist': sma_history}
-                )
-                
-
-            if ema_signal or sma_signal:
-                publish_sns_alert(
-                    signal=f"EMA: {ema_signal}, SMA: {sma_signal}",
-                    coin_id=coin_id,
-                    price=price,
-                    ema_short=ema_short,
-                    ema_long=ema_long,
-                    sma_short=sma_short,
-                    sma_long=sma_long,
-                    timestamp=timestamp,
-                    trend_status=trend_status
-                )
+@metrics.invocation
+def lambda_handler(event, context):
+    metrics.count('records', len(event['Records']))
+    if BATCH_PROCESSING:
+        process_batch(event['Records'])
+        log_cache_stats()
+        return {
+            'statusCode': 200,
+            'body': 'Processed Kinesis stream records.'
+        }
+
+    saved = {}
+    for record in event['Records']:
+        coin_id = None
+        try:
+            with metrics.timer('decode'):
+                payload = decode_kinesis_record(record)
+                if not payload:
+                    continue
+                coin_id, price, timestamp, volume = parse_tick(payload)
+            observe_market_cap(coin_id, payload)
+
+            # Load once (or reuse the warm copy), change in memory, save once
+            saved[coin_id] = save_with_retry(
+                load_state(coin_id),
+                lambda state: replay_ticks(state, [(price, timestamp, volume, record_source(record))])
+            )
 
         except Exception as e:
             print(f"❌ Error processing record: {e}")
             print(f"🔍 Raw record: {record}")
+            # A failed replay may have changed the saved copy in memory
+            if coin_id is not None:
+                saved.pop(coin_id, None)
 
+    update_read_models(deliver_alerts(saved.values()))
+    log_cache_stats()
     return {
         'statusCode': 200,
         'body': 'Processed Kinesis stream records.'
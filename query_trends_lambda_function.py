@@ -0,0 +1,46 @@
+import json
+import os
+from decimal import Decimal
+from aws_clients import DynamoDBTable
+from read_models import leaderboard, query
+
+# Read-only API for dashboards over the read model table (see read_models.py),
+# e.g. behind an API Gateway HTTP API:
+#
+#   GET ?coin=bitcoin           the coin's summary
+#   GET ?rule=ema&limit=20      the leaderboard and the last crosses
+READ_MODEL_TABLE = os.environ.get('READ_MODEL_TABLE', 'CryptoTrendViews_table')
+# Seconds a warm container reuses an answer before reading it again
+READ_MODEL_CACHE_TTL = float(os.environ.get('READ_MODEL_CACHE_TTL', '10'))
+
+table = DynamoDBTable(READ_MODEL_TABLE)
+
+class DecimalEncoder(json.JSONEncoder):
+    def default(self, obj):
+        if isinstance(obj, Decimal):
+            return float(obj)
+        return super().default(obj)
+
+def response(status, body):
+    return {
+        'statusCode': status,
+        'headers': {'Content-Type': 'application/json'},
+        'body': json.dumps(body, cls=DecimalEncoder)
+    }
+
+def lambda_handler(event, context):
+    params = (event or {}).get('queryStringParameters') or {}
+    try:
+        if params.get('coin'):
+            summary = query(table, params['coin'], READ_MODEL_CACHE_TTL)
+            if summary is None:
+                return response(404, {'error': f"No summary for {params['coin']}"})
+            return response(200, summary)
+
+        limit = int(params['limit']) if params.get('limit') else None
+        return response(200, leaderboard(table, params.get('rule', 'ema'), limit, READ_MODEL_CACHE_TTL))
+    except ValueError as e:
+        return response(400, {'error': str(e)})
+    except Exception as e:
+        print(f"❌ Error querying read models: {e}")
+        return response(500, {'error': 'Internal error'})
@@ -0,0 +1,190 @@
+import time
+import zlib
+from collections import OrderedDict
+from datetime import datetime
+from decimal import Decimal
+from botocore.exceptions import ClientError
+from aws_clients import batch_get_all
+
+# Small precomputed views of the trend table for dashboards. They live in
+# their own table, so polling never reads the 500-tick trend items or takes
+# capacity from the stream processor:
+#
+#   coin_id=<coin>            one summary per coin: latest price and indicator
+#                             values, trend_status, and per signal rule the
+#                             holding state and last profit, plus the last cross
+#   coin_id=#leaderboard#<n>  the headline numbers of the coins hashed to shard
+#                             n, in a `coins` map
+#   coin_id=#recent_crosses   the last RECENT_CROSSES_LIMIT crosses across all
+#                             coins, in a ring of `cross_<slot>` attributes
+#
+# The stream processor puts the summaries of the coins it saved and sets their
+# leaderboard rows by map path, so writes never read the leaderboard, never
+# conflict and each only touches one shard.
+
+LEADERBOARD_KEY = '#leaderboard'
+LEADERBOARD_SHARDS = 16
+# Coins set per UpdateItem, well within the expression size limits
+LEADERBOARD_WRITE_SIZE = 50
+RECENT_CROSSES_KEY = '#recent_crosses'
+RECENT_CROSSES_LIMIT = 20
+
+# (table name, key) -> (monotonic time read, answer), for query(). The least
+# recently used answers are dropped beyond CACHE_SIZE.
+CACHE_SIZE = 256
+cache = OrderedDict()
+
+
+def coin_summary(coin_id, item, price, indicators, signals):
+    # `item` is a saved trend item; `indicators` and `signals` are the
+    # configured indicator names and signal rule prefixes
+    summary = {
+        'coin_id': coin_id,
+        'price': price,
+        'last_updated': item.get('last_updated'),
+        'trend_status': item.get('trend_status'),
+        'version': item.get('version', 0)
+    }
+    summary.update({name: item[name] for name in indicators if name in item})
+
+    last_cross = None
+    for prefix in signals:
+        summary[f'{prefix}_status_holding'] = bool(item.get(f'{prefix}_status_holding', False))
+        for name in (f'{prefix}_profit', f'{prefix}_profit_percentage', f'{prefix}_num_profits'):
+            if name in item:
+                summary[name] = item[name]
+        crosses = item.get(f'{prefix}_cross_history') or []
+        if crosses and (last_cross is None or
+                        datetime.fromisoformat(crosses[-1]['timestamp']) > datetime.fromisoformat(last_cross['timestamp'])):
+            last_cross = dict(crosses[-1], rule=prefix)
+    if last_cross:
+        summary['last_cross'] = last_cross
+    return summary
+
+
+def leaderboard_row(summary, signals):
+    return {
+        'price': summary['price'],
+        'trend_status': summary.get('trend_status'),
+        'last_updated': summary.get('last_updated'),
+        'holding': [prefix for prefix in signals if summary.get(f'{prefix}_status_holding')],
+        'profit_percentage': {prefix: summary[f'{prefix}_profit_percentage'] for prefix in signals
+                              if f'{prefix}_profit_percentage' in summary}
+    }
+
+
+def write_summaries(table, summaries):
+    with table.batch_writer(overwrite_by_pkeys=['coin_id']) as batch:
+        for summary in summaries:
+            batch.put_item(Item=summary)
+
+
+def leaderboard_shard(coin_id):
+    return f'{LEADERBOARD_KEY}#{zlib.crc32(coin_id.encode()) % LEADERBOARD_SHARDS}'
+
+
+def set_rows(table, key, rows):
+    update = {
+        'Key': {'coin_id': key},
+        'UpdateExpression': 'SET ' + ', '.join(f'coins.#c{i} = :c{i}' for i in range(len(rows))),
+        'ExpressionAttributeNames': {f'#c{i}': coin_id for i, coin_id in enumerate(rows)},
+        'ExpressionAttributeValues': {f':c{i}': row for i, row in enumerate(rows.values())}
+    }
+    try:
+        table.update_item(**update)
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ValidationException':
+            raise
+        # The shard has no coins map yet
+        table.update_item(Key={'coin_id': key}, UpdateExpression='SET coins = if_not_exists(coins, :empty)',
+                          ExpressionAttributeValues={':empty': {}})
+        table.update_item(**update)
+
+
+def add_recent_crosses(table, crosses):
+    # Claims ring slots with an atomic counter, then fills them
+    crosses = crosses[-RECENT_CROSSES_LIMIT:]
+    if not crosses:
+        return
+    response = table.update_item(Key={'coin_id': RECENT_CROSSES_KEY}, UpdateExpression='ADD next_slot :count',
+                                 ExpressionAttributeValues={':count': len(crosses)}, ReturnValues='UPDATED_NEW')
+    first = int(response['Attributes']['next_slot']) - len(crosses)
+    table.update_item(
+        Key={'coin_id': RECENT_CROSSES_KEY},
+        UpdateExpression='SET ' + ', '.join(f'#s{i} = :s{i}' for i in range(len(crosses))),
+        ExpressionAttributeNames={f'#s{i}': f'cross_{(first + i) % RECENT_CROSSES_LIMIT}'
+                                  for i in range(len(crosses))},
+        ExpressionAttributeValues={f':s{i}': cross for i, cross in enumerate(crosses)}
+    )
+
+
+def merge_leaderboard(table, summaries, crosses, signals):
+    # One UpdateItem per shard (and LEADERBOARD_WRITE_SIZE coins) with rows of
+    # `summaries`, and two for `crosses`, which are {'coin', 'signal',
+    # 'price', 'timestamp'} maps. Last writer wins for a coin's row, like the
+    # summaries themselves.
+    shards = {}
+    for summary in summaries:
+        shards.setdefault(leaderboard_shard(summary['coin_id']), {})[summary['coin_id']] = \
+            leaderboard_row(summary, signals)
+    for key, rows in shards.items():
+        rows = list(rows.items())
+        for start in range(0, len(rows), LEADERBOARD_WRITE_SIZE):
+            set_rows(table, key, dict(rows[start:start + LEADERBOARD_WRITE_SIZE]))
+    add_recent_crosses(table, crosses)
+
+
+def read_leaderboard(table):
+    # All shards and the recent crosses in one BatchGetItem
+    keys = [{'coin_id': f'{LEADERBOARD_KEY}#{shard}'} for shard in range(LEADERBOARD_SHARDS)]
+    keys.append({'coin_id': RECENT_CROSSES_KEY})
+    items = batch_get_all(table, keys)
+
+    coins, recent = {}, {}
+    for item in items:
+        coins.update(item.get('coins', {}))
+        for slot in range(RECENT_CROSSES_LIMIT):
+            cross = item.get(f'cross_{slot}')
+            if cross:
+                recent[(cross['coin'], cross['signal'], cross['timestamp'])] = cross
+    return {
+        'coins': coins,
+        'recent_crosses': sorted(recent.values(), key=lambda cross: datetime.fromisoformat(cross['timestamp']),
+                                 reverse=True),
+        'updated': max((row['last_updated'] for row in coins.values() if row.get('last_updated')),
+                       default=None, key=datetime.fromisoformat)
+    }
+
+
+def query(table, coin_id=None, ttl=0):
+    # A coin's summary (one eventually consistent GetItem), or the merged
+    # leaderboard when coin_id is None. With ttl > 0 an answer is reused
+    # in-process for that many seconds. Returns None for a coin without a
+    # summary, which is not cached.
+    key = (table.name, coin_id or LEADERBOARD_KEY)
+    cached = cache.get(key)
+    if ttl > 0 and cached and time.monotonic() - cached[0] < ttl:
+        cache.move_to_end(key)
+        return cached[1]
+    answer = table.get_item(Key={'coin_id': coin_id}).get('Item') if coin_id else read_leaderboard(table)
+    if answer is None:
+        cache.pop(key, None)
+        return None
+    cache[key] = (time.monotonic(), answer)
+    cache.move_to_end(key)
+    while len(cache) > CACHE_SIZE:
+        cache.popitem(last=False)
+    return answer
+
+
+def leaderboard(table, rule='ema', limit=None, ttl=0):
+    # Coins ranked by the last profit of one signal rule (coins without a
+    # closed trade last), and the most recent crosses
+    item = query(table, ttl=ttl)
+    rows = [dict(row, coin_id=coin_id) for coin_id, row in item['coins'].items()]
+    rows.sort(key=lambda row: Decimal(row['profit_percentage'].get(rule, '-Infinity')), reverse=True)
+    return {
+        'updated': item['updated'],
+        'coins': rows[:limit] if limit else rows,
+        'recent_crosses': item['recent_crosses']
+    }
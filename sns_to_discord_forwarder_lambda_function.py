@@ -1,77 +1,215 @@
 import json
 import os
+import time
 import urllib3
+from concurrent.futures import ThreadPoolExecutor
+from instrumentation import Instrumentation
+from rate_limiter import TokenBucket
 
-http = urllib3.PoolManager()
 DISCORD_WEBHOOK_URL = os.environ.get('DISCORD_WEBHOOK_URL')
 
+# Delivery tuning. Discord allows up to 10 embeds per message and roughly
+# 5 requests per 2 seconds per webhook; the bucket also follows the
+# X-RateLimit-* headers Discord sends back.
+DISCORD_CONCURRENCY = int(os.environ.get('DISCORD_CONCURRENCY', '4'))
+DISCORD_EMBEDS_PER_MESSAGE = min(int(os.environ.get('DISCORD_EMBEDS_PER_MESSAGE', '10')), 10)
+DISCORD_RATE_LIMIT = int(os.environ.get('DISCORD_RATE_LIMIT', '5'))
+DISCORD_RATE_PERIOD = float(os.environ.get('DISCORD_RATE_PERIOD', '2'))
+DISCORD_MAX_ATTEMPTS = int(os.environ.get('DISCORD_MAX_ATTEMPTS', '4'))
+DISCORD_MAX_WAIT = float(os.environ.get('DISCORD_MAX_WAIT', '30'))
+
+GOLDEN_COLOR = 0x2ECC71
+DEAD_COLOR = 0xE74C3C
+SUMMARY_COLOR = 0x3498DB
+# Coin lines listed in a market summary embed before "... and N more"
+SUMMARY_MAX_SIGNALS = 25
+# Values compared by each signal, for alerts that do not list them
+DEFAULT_CROSSES = {'EMA': ['ema_short', 'ema_long'], 'SMA': ['sma_short', 'sma_long']}
+
+http = urllib3.PoolManager(maxsize=DISCORD_CONCURRENCY)
+
+# Stage timings and webhook request counts, flushed once per invocation
+metrics = Instrumentation('sns_to_discord_forwarder')
+
+# Shared by every sender thread
+bucket = TokenBucket(DISCORD_RATE_LIMIT, DISCORD_RATE_PERIOD)
+
+
+@metrics.invocation
 def lambda_handler(event, context):
     if not DISCORD_WEBHOOK_URL:
         raise ValueError("Missing DISCORD_WEBHOOK_URL in environment variables")
 
-    for record in event['Records']:
-        try:
-            sns_msg = json.loads(record['Sns']['Message'])
-
-            coin = sns_msg.get('coin', 'UNKNOWN').upper()
-            price = float(sns_msg.get('price', 0))
-            timestamp = sns_msg.get('timestamp', 'N/A')
-
-            # Extract individual components
-            signal = sns_msg.get('signal', '')  # e.g., "EMA: None, SMA: Dead Cross"
-            trend_status = sns_msg.get('trend_status', '')  # e.g., "EMA: Hold, SMA: Sell"
-            ema_short = sns_msg.get('ema_short', 'N/A')
-            ema_long = sns_msg.get('ema_long', 'N/A')
-            sma_short = sns_msg.get('sma_short', 'N/A')
-            sma_long = sns_msg.get('sma_long', 'N/A')
-
-            # Parse signals and statuses
-            ema_signal = next((s.strip().split(": ")[1] for s in signal.split(",") if "EMA" in s), None)
-            sma_signal = next((s.strip().split(": ")[1] for s in signal.split(",") if "SMA" in s), None)
-            ema_status = next((s.strip().split(": ")[1] for s in trend_status.split(",") if "EMA" in s), None)
-            sma_status = next((s.strip().split(": ")[1] for s in trend_status.split(",") if "SMA" in s), None)
-
-            # --- Compose and send EMA message if available ---
-            if ema_signal and ema_signal != "None":
-                content_ema = (
-                    f"📊 **EMA: {ema_signal}** detected for **{coin}**\n"
-                    f"📍 Trend Status: EMA: {ema_status}\n"
-                    f"💰 Price: ${price:,.5f}\n"
-                    f"📈 EMA Short: {ema_short} | EMA Long: {ema_long}\n"
-                    f"⏱ Timestamp: {timestamp}\n"
-                )
-                send_discord_message(content_ema)
-
-            # --- Compose and send SMA message if available ---
-            if sma_signal and sma_signal != "None":
-                content_sma = (
-                    f"📊 **SMA: {sma_signal}** detected for **{coin}**\n"
-                    f"📍 Trend Status: SMA: {sma_status}\n"
-                    f"💰 Price: ${price:,.5f}\n"
-                    f"📈 SMA Short: {sma_short} | SMA Long: {sma_long}\n"
-                    f"⏱ Timestamp: {timestamp}\n"
-                )
-                send_discord_message(content_sma)
+    embeds = []
+    with metrics.timer('decode'):
+        for record in event['Records']:
+            try:
+                embeds.extend(build_embeds(json.loads(record['Sns']['Message'])))
+            except Exception as e:
+                print(f"❌ Error processing record: {e}")
+                print(f"🔍 Raw record: {record}")
+
+    # All alerts from this SNS batch go out as a few multi-embed messages
+    messages = [
+        {'embeds': embeds[i:i + DISCORD_EMBEDS_PER_MESSAGE]}
+        for i in range(0, len(embeds), DISCORD_EMBEDS_PER_MESSAGE)
+    ]
 
-        except Exception as e:
-            print(f"❌ Error processing record: {e}")
-            print(f"🔍 Raw record: {record}")
+    with metrics.timer('deliver'), \
+            ThreadPoolExecutor(max_workers=max(1, min(DISCORD_CONCURRENCY, len(messages)))) as executor:
+        results = list(executor.map(send_discord_message, messages))
+
+    stats = delivery_stats(messages, results)
+    metrics.count('alerts_delivered', stats['delivered_alerts'])
+    metrics.count('alerts_dropped', stats['dropped_alerts'])
+    print(f"📬 Discord delivery: {json.dumps(stats)}")
 
     return {
         'statusCode': 200,
-        'body': 'Processed all alerts'
+        'body': json.dumps(stats)
+    }
+
+
+def parse_labels(text):
+    # "EMA: None, SMA: Dead Cross" -> {'EMA': 'None', 'SMA': 'Dead Cross'}
+    return dict(part.strip().split(': ', 1) for part in text.split(',') if ': ' in part)
+
+
+def display_name(key):
+    # 'ema_short' -> 'EMA Short', 'macd_signal' -> 'MACD Signal'
+    first, *rest = key.split('_')
+    return ' '.join([first.upper()] + [part.capitalize() for part in rest])
+
+
+def build_summary_embed(sns_msg):
+    # One embed for a burst of crosses across the market (see market_breadth.py)
+    signals = sns_msg.get('signals', [])
+    lines = [f"• {entry['coin'].upper()} ${float(entry['price']):,.5f} — {entry['signal']}"
+             for entry in signals[:SUMMARY_MAX_SIGNALS]]
+    if len(signals) > SUMMARY_MAX_SIGNALS:
+        lines.append(f"… and {len(signals) - SUMMARY_MAX_SIGNALS} more")
+
+    pct_above = sns_msg.get('pct_above_sma_long')
+    trend = sns_msg.get('cap_weighted_trend')
+    golden, dead = sns_msg.get('golden_crosses', 0), sns_msg.get('dead_crosses', 0)
+    return {
+        'title': f"🌐 Market summary: {len(signals)} signals",
+        'color': GOLDEN_COLOR if golden > dead else DEAD_COLOR if dead > golden else SUMMARY_COLOR,
+        'description': (
+            f"📈 Above SMA Long: {'N/A' if pct_above is None else f'{pct_above:.1f}%'} "
+            f"of {sns_msg.get('coins', 0)} coins\n"
+            f"🔀 Last {sns_msg.get('window_minutes', 'N/A')} min: {golden} golden / {dead} dead crosses\n"
+            f"⚖️ Cap-weighted trend: {'N/A' if trend is None else f'{trend:+.2f}'}\n"
+            f"⏱ Timestamp: {sns_msg.get('timestamp', 'N/A')}\n\n"
+            + "\n".join(lines)
+        )
     }
 
 
-def send_discord_message(content):
-    response = http.request(
-        "POST",
-        DISCORD_WEBHOOK_URL,
-        headers={"Content-Type": "application/json"},
-        body=json.dumps({"content": content})
-    )
-    if response.status == 204:
-        print("✅ Alert sent to Discord")
-    else:
+def build_embeds(sns_msg):
+    if sns_msg.get('type') == 'market_summary':
+        return [build_summary_embed(sns_msg)]
+
+    coin = sns_msg.get('coin', 'UNKNOWN').upper()
+    price = float(sns_msg.get('price', 0))
+    timestamp = sns_msg.get('timestamp', 'N/A')
+
+    # Parse signals and statuses, e.g. "EMA: None, SMA: Dead Cross" and "EMA: Hold, SMA: Sell"
+    signals = parse_labels(sns_msg.get('signal', ''))
+    statuses = parse_labels(sns_msg.get('trend_status', ''))
+    crosses = sns_msg.get('crosses', DEFAULT_CROSSES)
+
+    embeds = []
+    for label, ma_signal in signals.items():
+        if not ma_signal or ma_signal == "None":
+            continue
+        fast, slow = crosses.get(label, (f'{label.lower()}_short', f'{label.lower()}_long'))
+        embeds.append({
+            'title': f"📊 {label}: {ma_signal} detected for {coin}",
+            'color': GOLDEN_COLOR if ma_signal == 'Golden Cross' else DEAD_COLOR,
+            'description': (
+                f"📍 Trend Status: {label}: {statuses.get(label)}\n"
+                f"💰 Price: ${price:,.5f}\n"
+                f"📈 {display_name(fast)}: {sns_msg.get(fast, 'N/A')} | "
+                f"{display_name(slow)}: {sns_msg.get(slow, 'N/A')}\n"
+                f"⏱ Timestamp: {timestamp}\n"
+            )
+        })
+    return embeds
+
+
+def rate_limit_wait(response):
+    # Seconds to wait from a 429 body or the Retry-After header
+    try:
+        return float(json.loads(response.data.decode('utf-8')).get('retry_after'))
+    except Exception:
+        return float(response.headers.get('Retry-After', DISCORD_RATE_PERIOD))
+
+
+def send_discord_message(payload):
+    # Returns (delivered, attempts, latency in seconds)
+    started = time.monotonic()
+    for attempt in range(1, DISCORD_MAX_ATTEMPTS + 1):
+        bucket.acquire()
+        body = json.dumps(payload)
+        try:
+            with metrics.timer('webhook'):
+                response = http.request(
+                    "POST",
+                    DISCORD_WEBHOOK_URL,
+                    headers={"Content-Type": "application/json"},
+                    body=body
+                )
+            metrics.count('discord_calls')
+            metrics.count('discord_bytes_sent', len(body), 'Bytes')
+        except urllib3.exceptions.HTTPError as e:
+            print(f"⚠️ Discord request error: {e}")
+            time.sleep(min(2 ** attempt * 0.25, DISCORD_MAX_WAIT))
+            continue
+
+        if response.headers.get('X-RateLimit-Remaining') == '0':
+            bucket.block_for(float(response.headers.get('X-RateLimit-Reset-After', DISCORD_RATE_PERIOD)))
+
+        if response.status in (200, 204):
+            print(f"✅ Alert sent to Discord ({len(payload['embeds'])} embeds)")
+            return True, attempt, time.monotonic() - started
+
+        if response.status == 429:
+            metrics.count('discord_rate_limited')
+            wait = rate_limit_wait(response)
+            print(f"⏳ Discord rate limited, retrying in {wait:.2f}s")
+            if wait > DISCORD_MAX_WAIT:
+                break
+            bucket.block_for(wait)
+            continue
+
         print(f"⚠️ Discord send failed with status: {response.status}")
         print(response.data.decode('utf-8'))
+        if response.status < 500:
+            break
+        time.sleep(min(2 ** attempt * 0.25, DISCORD_MAX_WAIT))
+
+    return False, attempt, time.monotonic() - started
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def delivery_stats(messages, results):
+    latencies = [latency for _, _, latency in results]
+    delivered = [message for message, (ok, _, _) in zip(messages, results) if ok]
+    dropped = [message for message, (ok, _, _) in zip(messages, results) if not ok]
+    return {
+        'alerts': sum(len(m['embeds']) for m in messages),
+        'messages': len(messages),
+        'delivered_alerts': sum(len(m['embeds']) for m in delivered),
+        'dropped_alerts': sum(len(m['embeds']) for m in dropped),
+        'retries': sum(attempts - 1 for _, attempts, _ in results),
+        'latency_p50_ms': round(percentile(latencies, 50) * 1000, 1),
+        'latency_p99_ms': round(percentile(latencies, 99) * 1000, 1),
+        'latency_max_ms': round(max(latencies, default=0.0) * 1000, 1)
+    }
@@ -0,0 +1,55 @@
+# Append-only store for cross and profit history. Each entry is its own small
+# item keyed by coin_id plus `<kind>#<timestamp>`, so the coin's trend item only
+# has to carry counters and the most recent entries.
+#
+# Kinds: ema_cross, ema_golden_cross, ema_dead_cross, ema_profit and the same
+# four for sma.
+
+HISTORY_KINDS = ('cross', 'golden_cross', 'dead_cross', 'profit')
+
+
+def event_key(kind, timestamp):
+    return f"{kind}#{timestamp}"
+
+
+def write_events(events_table, coin_id, events):
+    # Puts are keyed by kind and timestamp, so writing the same event twice
+    # (e.g. after a retried batch) leaves one copy
+    if not events:
+        return 0
+    with events_table.batch_writer(overwrite_by_pkeys=['coin_id', 'event_key']) as batch:
+        for kind, timestamp, entry in events:
+            batch.put_item(Item={
+                'coin_id': coin_id,
+                'event_key': event_key(kind, timestamp),
+                'kind': kind,
+                'timestamp': timestamp,
+                'data': entry
+            })
+    return len(events)
+
+
+def read_history(events_table, coin_id, kind, limit=50, start_key=None, newest_first=True):
+    # One page of a coin's history for one kind. Pass the returned key back in
+    # as start_key for the next page; it is None once the history is exhausted.
+    query_kwargs = {
+        'KeyConditionExpression': 'coin_id = :coin_id AND begins_with(event_key, :prefix)',
+        'ExpressionAttributeValues': {':coin_id': coin_id, ':prefix': f"{kind}#"},
+        'ScanIndexForward': not newest_first,
+        'Limit': limit
+    }
+    if start_key:
+        query_kwargs['ExclusiveStartKey'] = start_key
+
+    response = events_table.query(**query_kwargs)
+    entries = [item['data'] for item in response.get('Items', [])]
+    return entries, response.get('LastEvaluatedKey')
+
+
+def iter_history(events_table, coin_id, kind, page_size=100, newest_first=True):
+    start_key = None
+    while True:
+        entries, start_key = read_history(events_table, coin_id, kind, page_size, start_key, newest_first)
+        yield from entries
+        if not start_key:
+            return